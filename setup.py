@@ -29,6 +29,7 @@ setup(
             'surreal-ddpg=surreal.main.ddpg_configs:main',
             'surreal-ppo=surreal.main.ppo_configs:main',
             'surreal-default-config=surreal.main.generate_default_config:main',
+            'surreal-benchmark-replay=surreal.benchmark.replay_throughput:main',
         ]
     },
     install_requires=[
@@ -14,7 +14,8 @@ from surreal.env import (
     MaxStepWrapper,
     TrainingTensorplexMonitor,
     EvalTensorplexMonitor,
-    VideoWrapper
+    VideoWrapper,
+    ExpSenderWrapperBase,
 )
 
 AGENT_MODES = ['training', 'eval_deterministic', 'eval_stochastic', 
@@ -54,6 +55,9 @@ class Agent(object, metaclass=U.AutoInitializeMeta):
         self.current_episode = 0
         self.cumulative_steps = 0
         self.current_step = 0
+        # learner iteration of the current parameters,
+        # sent along with every experience
+        self.param_version = 0
 
         self.actions_since_param_update = 0
         self.episodes_since_param_update = 0
@@ -69,13 +73,26 @@ class Agent(object, metaclass=U.AutoInitializeMeta):
             self.module_dict can only happen after the module is constructed by subclasses.
         """
         if self.agent_mode not in ['eval_deterministic_local', 'eval_stochastic_local']:
-            host, port = os.environ['SYMPH_PS_FRONTEND_HOST'], os.environ['SYMPH_PS_FRONTEND_PORT']
+            # fetch from the ps_relay if one is launched, see setup_network
+            if 'SYMPH_PS_RELAY_FRONTEND_HOST' in os.environ:
+                ps_env = 'SYMPH_PS_RELAY'
+            else:
+                ps_env = 'SYMPH_PS'
+            host = os.environ[ps_env + '_FRONTEND_HOST']
+            port = os.environ[ps_env + '_FRONTEND_PORT']
             self._module_dict = self.module_dict()
             if not isinstance(self._module_dict, ModuleDict):
                 self._module_dict = ModuleDict(self._module_dict)
+            notify_host, notify_port = None, None
+            if self.session_config.agent.parameter_notify:
+                notify_host = os.environ[ps_env + '_NOTIFY_HOST']
+                notify_port = os.environ[ps_env + '_NOTIFY_PORT']
             self._ps_client = ParameterClient(
                 host=host,
                 port=port,
+                notify_host=notify_host,
+                notify_port=notify_port,
+                poll_interval=self.session_config.agent.parameter_notify_poll_interval,
             )
 
     def _setup_parameter_pull(self):
@@ -358,9 +375,24 @@ class Agent(object, metaclass=U.AutoInitializeMeta):
         """
         params, info = self._ps_client.fetch_parameter_with_info()
         if params:
-            params = U.deserialize(params)
+            if isinstance(params, bytes):
+                # reconstructed from deltas otherwise
+                params = U.deserialize(params)
             params = self.on_parameter_fetched(params, info)
             self._module_dict.load(params)
+            self.param_version = info['iteration']
+            self._stamp_param_version()
+
+    def _stamp_param_version(self):
+        """
+            Experiences sent from now on carry the version
+            of the parameters just loaded
+        """
+        env = getattr(self, 'env', None)
+        while env is not None:
+            if isinstance(env, ExpSenderWrapperBase):
+                env.sender.param_version = self.param_version
+            env = getattr(env, 'env', None)
 
     def fetch_parameter_info(self):
         """
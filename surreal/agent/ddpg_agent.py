@@ -10,7 +10,7 @@ import torchx as tx
 import torchx.nn as nnx
 from surreal.distributed import ModuleDict
 from surreal.model.ddpg_net import DDPGModel
-from surreal.env import ExpSenderWrapperSSARNStepBootstrap
+from surreal.env import ExpSenderWrapperSSARNStepBootstrap, ExpSenderWrapperTrajectory
 from surreal.session import ConfigError
 from .base import Agent
 from .action_noise import *
@@ -209,7 +209,12 @@ class DDPGAgent(Agent):
 
     def prepare_env_agent(self, env):
         env = super().prepare_env_agent(env)
-        env = ExpSenderWrapperSSARNStepBootstrap(env,
-                                                 self.learner_config,
-                                                 self.session_config)
+        if self.learner_config.replay.trajectory.enabled:
+            env = ExpSenderWrapperTrajectory(env,
+                                             self.learner_config,
+                                             self.session_config)
+        else:
+            env = ExpSenderWrapperSSARNStepBootstrap(env,
+                                                     self.learner_config,
+                                                     self.session_config)
         return env
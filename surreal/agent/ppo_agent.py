@@ -8,7 +8,10 @@ import torchx as tx
 import torchx.nn as nnx
 import surreal.utils as U
 from surreal.model.ppo_net import PPOModel, DiagGauss
-from surreal.env import ExpSenderWrapperMultiStepMovingWindowWithInfo
+from surreal.env import (
+    ExpSenderWrapperMultiStepMovingWindowWithInfo,
+    ExpSenderWrapperTrajectoryWithInfo,
+)
 from surreal.session import ConfigError
 from .base import Agent
 
@@ -184,7 +187,12 @@ class PPOAgent(Agent):
 
     def prepare_env_agent(self, env):
         env = super().prepare_env_agent(env)
-        env = ExpSenderWrapperMultiStepMovingWindowWithInfo(env,
-                                                            self.learner_config,
-                                                            self.session_config)
+        if self.learner_config.replay.trajectory.enabled:
+            env = ExpSenderWrapperTrajectoryWithInfo(env,
+                                                     self.learner_config,
+                                                     self.session_config)
+        else:
+            env = ExpSenderWrapperMultiStepMovingWindowWithInfo(env,
+                                                                self.learner_config,
+                                                                self.session_config)
         return env
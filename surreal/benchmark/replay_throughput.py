@@ -0,0 +1,384 @@
+"""
+Throughput benchmark of the replay shards in isolation, on localhost:
+synthetic agents push experiences through ExpSender, replay shards
+run behind the usual load balancing proxies, and synthetic learner
+clients request batches as fast as they are served.
+
+Reports exp in / exp out rates, p50 / p99 latencies of insert_batch(),
+sample() and of the learner requests, and bytes per second both ways.
+
+Usage:
+    surreal-benchmark-replay --replay UniformReplay --shards 2 --agents 8 \\
+        --pixel-shape 9 84 84 --set learner_config.replay.storage=frame_stack \\
+        --set env_config.frame_stacks=3
+"""
+import argparse
+import importlib
+import json
+import os
+import queue
+import tempfile
+import time
+from multiprocessing import Process, Event, Queue
+import numpy as np
+from caraml.zmq import ZmqClient
+import surreal.utils as U
+from surreal.session import (
+    Config,
+    BASE_LEARNER_CONFIG,
+    BASE_ENV_CONFIG,
+    LOCAL_SESSION_CONFIG,
+)
+from surreal.distributed import ExpSender
+from surreal.distributed.shm_ring import read_shm_ring
+from surreal.replay import ReplayLoadBalancer
+
+# offsets from --base-port, same variables as the launchers export
+_PORTS = {
+    'SYMPH_COLLECTOR_FRONTEND_PORT': 0,
+    'SYMPH_COLLECTOR_BACKEND_PORT': 1,
+    'SYMPH_SAMPLER_FRONTEND_PORT': 2,
+    'SYMPH_SAMPLER_BACKEND_PORT': 3,
+    'SYMPH_PRIORITY_UPDATE_PORT': 4,
+    'SYMPH_LOGGERPLEX_PORT': 5,
+    'SYMPH_TENSORPLEX_PORT': 6,
+}
+_HOSTS = [
+    'SYMPH_SAMPLER_FRONTEND_HOST',
+    'SYMPH_PRIORITY_UPDATE_HOST',
+    'SYMPH_LOGGERPLEX_HOST',
+    'SYMPH_TENSORPLEX_HOST',
+]
+
+
+def _setup_env(base_port):
+    for name, offset in _PORTS.items():
+        os.environ[name] = str(base_port + offset)
+    for name in _HOSTS:
+        os.environ[name] = '127.0.0.1'
+
+
+def _load_replay_class(name):
+    """
+    Args:
+        name: class exported by surreal.replay, or 'package.module:Class'
+    """
+    if ':' in name:
+        module_name, class_name = name.split(':')
+    else:
+        module_name, class_name = 'surreal.replay', name
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def _set_config(configs, assignment):
+    """
+    Args:
+        configs: {'learner_config': Config, ...}
+        assignment: 'learner_config.replay.storage=columnar',
+            values are parsed as json when possible
+    """
+    path, value = assignment.split('=', 1)
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    keys = path.split('.')
+    config = configs[keys[0]]
+    for key in keys[1:-1]:
+        config = config[key]
+    config[keys[-1]] = value
+
+
+def build_configs(args):
+    """
+    Returns:
+        learner_config, env_config, session_config for the replay shards
+    """
+    obs_spec = {'low_dim': {'flat_inputs': [args.obs_dim]}}
+    if args.pixel_shape:
+        obs_spec['pixel'] = {'camera0': args.pixel_shape}
+    learner_config = {
+        'model': {},
+        'algo': {
+            'gamma': .99,
+        },
+        'replay': {
+            'batch_size': args.batch_size,
+            'memory_size': args.memory_size,
+            'sampling_start_size': args.sampling_start_size,
+            'replay_shards': args.shards,
+        },
+    }
+    env_config = {
+        'env_name': 'benchmark',
+        'obs_spec': obs_spec,
+        'action_spec': {'type': 'continuous', 'dim': [args.action_dim]},
+    }
+    session_config = {
+        'folder': tempfile.mkdtemp(prefix='surreal-benchmark-'),
+        'replay': {
+            'tensorboard_display': False,
+        },
+        'sender': {
+            'flush_iteration': args.flush_iteration,
+        },
+        'loggerplex': {
+            'enable_local_logger': False,
+        },
+    }
+    configs = {
+        'learner_config': learner_config,
+        'env_config': env_config,
+        'session_config': session_config,
+    }
+    for assignment in args.set:
+        _set_config(configs, assignment)
+    learner_config = Config(learner_config)
+    learner_config.extend(BASE_LEARNER_CONFIG)
+    env_config = Config(env_config)
+    env_config.extend(BASE_ENV_CONFIG)
+    session_config = Config(session_config)
+    session_config.extend(LOCAL_SESSION_CONFIG)
+    return learner_config, env_config, session_config
+
+
+def _random_obs(obs_spec):
+    obs = {}
+    for modality, keys in obs_spec.items():
+        obs[modality] = {}
+        for key, shape in keys.items():
+            if modality == 'pixel':
+                obs[modality][key] = np.random.randint(
+                    256, size=shape, dtype=np.uint8)
+            else:
+                obs[modality][key] = np.random.randn(*shape).astype(np.float32)
+    return obs
+
+
+class _ByteCounter(object):
+    """
+        Wraps the ZmqSender of an ExpSender to count the bytes sent
+    """
+    def __init__(self, client):
+        self.client = client
+        self.nbytes = 0
+
+    def send(self, binary):
+        self.nbytes += len(binary)
+        self.client.send(binary)
+
+
+def run_agent(env_config, session_config, obs_pool, stop, results):
+    """
+        Sends experiences in ExpSenderWrapperSSAR format as fast as possible.
+        Observations cycle through a pool of obs_pool random observations,
+        obs_next of a step is obs of the next one as with a real env
+    """
+    sender = ExpSender(host='localhost',
+                       port=os.environ['SYMPH_COLLECTOR_FRONTEND_PORT'],
+                       flush_iteration=session_config.sender.flush_iteration)
+    sender._client = counter = _ByteCounter(sender._client)
+    pool = [_random_obs(env_config.obs_spec) for _ in range(obs_pool)]
+    action = np.zeros(env_config.action_spec.dim, dtype=np.float32)
+    sent = 0
+    while not stop.is_set():
+        sender.send(
+            hash_dict={'obs': [pool[sent % obs_pool],
+                               pool[(sent + 1) % obs_pool]]},
+            nonhash_dict={
+                'action': action,
+                'reward': 0.,
+                'done': False,
+                'info': {},
+            })
+        sent += 1
+    results.put(('agent', {'sent_exps': sent, 'sent_bytes': counter.nbytes}))
+
+
+def _timed(fn, latencies):
+    def timed_fn(*args, **kwargs):
+        start = time.time()
+        result = fn(*args, **kwargs)
+        latencies.append(time.time() - start)
+        return result
+    return timed_fn
+
+
+def run_shard(replay_class, learner_config, env_config, session_config,
+              index, stop, results):
+    replay = replay_class(learner_config,
+                          env_config,
+                          session_config,
+                          index=index)
+    insert_latencies, sample_latencies = [], []
+    # both run with the memory lock held
+    replay.insert_batch = _timed(replay.insert_batch, insert_latencies)
+    replay.sample = _timed(replay.sample, sample_latencies)
+    replay.start_threads()
+    stop.wait()
+    with replay._memory_lock:
+        results.put(('shard', {
+            'inserted_exps': replay.cumulative_collected_count,
+            'sampled_exps': replay.cumulative_sampled_count,
+            'num_exps': len(replay),
+            'memory_bytes': replay.memory_nbytes(),
+            'insert_latencies': insert_latencies,
+            'sample_latencies': sample_latencies,
+        }))
+
+
+def run_learner(learner_config, session_config, stop, results):
+    """
+        Requests batches in a loop, like one LearnerDataPrefetcher worker
+    """
+    client = ZmqClient(host=os.environ['SYMPH_SAMPLER_FRONTEND_HOST'],
+                       port=os.environ['SYMPH_SAMPLER_FRONTEND_PORT'])
+    batch_size = learner_config.replay.batch_size
+    request = U.serialize(batch_size)
+    shm_ring = bool(session_config.replay.shm_ring_bytes)
+    latencies = []
+    received_exps, received_bytes, empty_replies = 0, 0, 0
+    first_batch_time = None
+    while not stop.is_set():
+        start = time.time()
+        data = client.request(request)
+        if shm_ring:
+            data = read_shm_ring(U.deserialize(data))
+        batch = U.deserialize(data) if data is not None else None
+        latencies.append(time.time() - start)
+        if batch is None:
+            empty_replies += 1
+            continue
+        if first_batch_time is None:
+            first_batch_time = time.time()
+        received_exps += batch_size
+        received_bytes += len(data)
+    results.put(('learner', {
+        'received_exps': received_exps,
+        'received_bytes': received_bytes,
+        'empty_replies': empty_replies,
+        'request_latencies': latencies,
+        'sampling_time': time.time() - first_batch_time
+                         if first_batch_time is not None else 0.,
+    }))
+
+
+def _percentiles(latencies):
+    if len(latencies) == 0:
+        return 'n/a'
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    return 'p50 {:8.3f} ms  p99 {:8.3f} ms  ({} calls)'.format(
+        p50, p99, len(latencies))
+
+
+def report(reports, duration):
+    agents = reports['agent']
+    shards = reports['shard']
+    learners = reports['learner']
+    sent_exps = sum(r['sent_exps'] for r in agents)
+    sent_bytes = sum(r['sent_bytes'] for r in agents)
+    inserted_exps = sum(r['inserted_exps'] for r in shards)
+    received_exps = sum(r['received_exps'] for r in learners)
+    received_bytes = sum(r['received_bytes'] for r in learners)
+    sampling_time = max([r['sampling_time'] for r in learners] + [1e-6])
+    print('Over {:.1f}s with {} agents, {} shards, {} learner clients:'.format(
+        duration, len(agents), len(shards), len(learners)))
+    print('  exp in:   {:10.1f} exps/s sent, {:10.1f} exps/s inserted, '
+          '{:8.2f} MB/s'.format(sent_exps / duration, inserted_exps / duration,
+                                sent_bytes / duration / 1e6))
+    print('  exp out:  {:10.1f} exps/s once sampling started, '
+          '{:8.2f} MB/s, {} empty replies'.format(
+              received_exps / sampling_time, received_bytes / sampling_time / 1e6,
+              sum(r['empty_replies'] for r in learners)))
+    print('  insert_batch: ' + _percentiles(
+        [t for r in shards for t in r['insert_latencies']]))
+    print('  sample:       ' + _percentiles(
+        [t for r in shards for t in r['sample_latencies']]))
+    print('  request:      ' + _percentiles(
+        [t for r in learners for t in r['request_latencies']]))
+    for i, r in enumerate(shards):
+        print('  shard {}: {} exps held, {:.1f} MB'.format(
+            i, r['num_exps'], r['memory_bytes'] / 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--replay', type=str, default='UniformReplay',
+                        help='Replay subclass, exported by surreal.replay '
+                             'or given as package.module:Class')
+    parser.add_argument('--shards', type=int, default=1)
+    parser.add_argument('--agents', type=int, default=4)
+    parser.add_argument('--learner-clients', type=int, default=2,
+                        help='number of processes requesting batches, '
+                             'like session_config.learner.prefetch_processes')
+    parser.add_argument('--duration', type=float, default=30.,
+                        help='in seconds')
+    parser.add_argument('--obs-dim', type=int, default=17)
+    parser.add_argument('--pixel-shape', type=int, nargs=3, default=None,
+                        help='C H W of a uint8 pixel observation, none by default')
+    parser.add_argument('--action-dim', type=int, default=6)
+    parser.add_argument('--obs-pool', type=int, default=64,
+                        help='distinct random observations per agent')
+    parser.add_argument('--flush-iteration', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=512)
+    parser.add_argument('--memory-size', type=int, default=100000,
+                        help='per shard')
+    parser.add_argument('--sampling-start-size', type=int, default=1000)
+    parser.add_argument('--base-port', type=int, default=7100)
+    parser.add_argument('--set', type=str, action='append', default=[],
+                        help='any other config value, e.g. '
+                             'session_config.replay.sampler_workers=4')
+    args = parser.parse_args()
+
+    _setup_env(args.base_port)
+    replay_class = _load_replay_class(args.replay)
+    learner_config, env_config, session_config = build_configs(args)
+
+    stop = Event()
+    results = Queue()
+    processes = []
+    for i in range(args.shards):
+        processes.append(Process(
+            target=run_shard,
+            args=[replay_class, learner_config, env_config, session_config,
+                  i, stop, results]))
+    for _ in range(args.learner_clients):
+        processes.append(Process(
+            target=run_learner,
+            args=[learner_config, session_config, stop, results]))
+    for _ in range(args.agents):
+        processes.append(Process(
+            target=run_agent,
+            args=[env_config, session_config, args.obs_pool, stop, results]))
+    print('Benchmarking {} for {:.0f}s'.format(replay_class.__name__,
+                                               args.duration))
+    start = time.time()
+    for p in processes:
+        p.start()
+    # proxy threads start after forking
+    loadbalancer = ReplayLoadBalancer(
+        weighted_sampling=learner_config.replay.weighted_sampling,
+        shards=args.shards)
+    loadbalancer.launch()
+    time.sleep(args.duration)
+    stop.set()
+    duration = time.time() - start
+
+    reports = {'agent': [], 'shard': [], 'learner': []}
+    for _ in range(len(processes)):
+        try:
+            kind, result = results.get(timeout=30)
+        except queue.Empty:
+            print('Some processes did not report')
+            break
+        reports[kind].append(result)
+    for p in processes:
+        p.terminate()
+    report(reports, duration)
+    U.f_remove(session_config.folder)
+    # the proxy threads never return
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
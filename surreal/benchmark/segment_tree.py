@@ -0,0 +1,86 @@
+"""
+Micro-benchmark of the list-based and numpy segment trees
+used by prioritized replay.
+
+Usage:
+    python -m surreal.benchmark.segment_tree --capacity 1048576 --batch-size 512
+"""
+import argparse
+import time
+import numpy as np
+from surreal.replay.segment_tree import (
+    SumSegmentTree, MinSegmentTree, NumpySumSegmentTree, NumpyMinSegmentTree
+)
+
+
+def _timeit(fn, iterations):
+    start = time.time()
+    for _ in range(iterations):
+        fn()
+    return (time.time() - start) / iterations
+
+
+def bench_list_trees(capacity, batch_size, iterations):
+    sum_tree = SumSegmentTree(capacity)
+    min_tree = MinSegmentTree(capacity)
+    for i in range(capacity):
+        sum_tree[i] = 1.0
+        min_tree[i] = 1.0
+
+    def update():
+        indices = np.random.randint(0, capacity, batch_size)
+        priorities = np.random.rand(batch_size)
+        for idx, priority in zip(indices, priorities):
+            sum_tree[int(idx)] = priority
+            min_tree[int(idx)] = priority
+
+    def sample():
+        masses = np.random.rand(batch_size) * sum_tree.sum()
+        [sum_tree.find_prefixsum_idx(mass) for mass in masses]
+        min_tree.min()
+
+    return _timeit(update, iterations), _timeit(sample, iterations)
+
+
+def bench_numpy_trees(capacity, batch_size, iterations):
+    sum_tree = NumpySumSegmentTree(capacity)
+    min_tree = NumpyMinSegmentTree(capacity)
+    sum_tree[np.arange(capacity)] = 1.0
+    min_tree[np.arange(capacity)] = 1.0
+
+    def update():
+        indices = np.random.randint(0, capacity, batch_size)
+        priorities = np.random.rand(batch_size)
+        sum_tree[indices] = priorities
+        min_tree[indices] = priorities
+
+    def sample():
+        masses = np.random.rand(batch_size) * sum_tree.sum()
+        sum_tree.find_prefixsum_idx(masses)
+        min_tree.min()
+
+    return _timeit(update, iterations), _timeit(sample, iterations)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--capacity', type=int, default=2 ** 20)
+    parser.add_argument('--batch-size', type=int, default=512)
+    parser.add_argument('--iterations', type=int, default=100)
+    args = parser.parse_args()
+
+    print('Segment tree benchmark: capacity {}, batch size {}'.format(
+        args.capacity, args.batch_size))
+    results = [
+        ('list', bench_list_trees(args.capacity, args.batch_size,
+                                  args.iterations)),
+        ('numpy', bench_numpy_trees(args.capacity, args.batch_size,
+                                    args.iterations)),
+    ]
+    for name, (update_time, sample_time) in results:
+        print('{:>6}: update {:8.3f} ms/batch, sample {:8.3f} ms/batch'.format(
+            name, update_time * 1000, sample_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,8 @@ from .exp_sender import ExpSender
 from .exp_collector import ExperienceCollectorServer
 from .data_fetcher import LearnerDataPrefetcher
 from .module_dict import ModuleDict
+from .priority_update import PriorityUpdatePublisher
+from .shm_ring import ShmRingWriter, shm_ring_deserialize
 from .parameter_server import (
     ParameterPublisher,
     ParameterClient,
@@ -3,6 +3,7 @@ import queue
 from caraml.zmq import DataFetcher
 from benedict import BeneDict
 import surreal.utils as U
+from .shm_ring import shm_ring_deserialize
 from threading import Thread
 
 
@@ -33,6 +34,11 @@ class LearnerDataPrefetcher(DataFetcher):
         self.worker_comm_port = os.environ['SYMPH_PREFETCH_QUEUE_PORT']
         self.worker_preprocess = worker_preprocess
         self.main_preprocess = main_preprocess
+        if session_config.replay.shm_ring_bytes:
+            # replays on this host reply with descriptors of shared memory
+            remote_deserializer = shm_ring_deserialize
+        else:
+            remote_deserializer = U.deserialize
         super().__init__(
             handler=self._put,
             remote_host=self.sampler_host,
@@ -40,7 +46,7 @@ class LearnerDataPrefetcher(DataFetcher):
             requests=self.request_generator(),
             worker_comm_port=self.worker_comm_port,
             remote_serializer=U.serialize,
-            remote_deserialzer=U.deserialize,
+            remote_deserialzer=remote_deserializer,
             n_workers=self.prefetch_processes,
             worker_handler=self.worker_preprocess)
 
@@ -53,6 +59,9 @@ class LearnerDataPrefetcher(DataFetcher):
     def _preprocess_loop(self):
         while True:
             sharedmem_obj = self.fetch_queue.get(block=True)
+            if sharedmem_obj.data is None:
+                # replay was not ready to sample
+                continue
             batch = BeneDict(sharedmem_obj.data)
             batch = self.main_preprocess(batch)
             self.preprocess_queue.put(batch)
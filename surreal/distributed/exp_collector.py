@@ -9,12 +9,17 @@ class ExperienceCollectorServer(Thread):
         Accepts experience from agents,
         deduplicates experience whenever possible
     """
-    def __init__(self, host, port, exp_handler, load_balanced=True):
+    def __init__(self, host, port, exp_list_handler, load_balanced=True):
+        """
+        Args:
+            exp_list_handler: called once per received message
+                with the list of experiences it contains
+        """
         Thread.__init__(self)
         self.host = host
         self.port = port
         self.load_balanced = load_balanced
-        self._exp_handler = exp_handler
+        self._exp_list_handler = exp_list_handler
         # To be initialized in run()
         self._weakref_map = None
         self.receiver = None
@@ -31,8 +36,7 @@ class ExperienceCollectorServer(Thread):
         while True:
             exp, storage = self.receiver.recv()
             experience_list = self._retrieve_storage(exp, storage)
-            for exp in experience_list:
-                self._exp_handler(exp)
+            self._exp_list_handler(experience_list)
 
     def _retrieve_storage(self, exp, storage):
         """
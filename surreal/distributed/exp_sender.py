@@ -78,6 +78,8 @@ class ExpSender(object):
                                  port=port)
         self._exp_buffer = ExpBuffer()
         self._flush_tracker = PeriodicTracker(flush_iteration)
+        # learner iteration of the parameters acting, set by the agent
+        self.param_version = 0
 
     def send(self, hash_dict, nonhash_dict):
         """
@@ -85,7 +87,11 @@ class ExpSender(object):
             hash_dict: Large/Heavy data that should be deduplicated
                        by the caching mekanism
             nonhash_dict: Small data that we can afford to keep copies of
+
+        Every experience is stamped with `param_version`, replays
+        use it to measure and bound staleness
         """
+        nonhash_dict = dict(nonhash_dict, param_version=self.param_version)
         self._exp_buffer.add(
             hash_dict=hash_dict,
             nonhash_dict=nonhash_dict,
@@ -3,6 +3,7 @@ import torch
 from surreal.utils.numpy_util import np_cast
 import surreal.utils as U
 import torchx.nn as nnx
+from .param_delta import encode_wire_params, decode_wire
 
 
 class ModuleDict(object):
@@ -19,20 +20,34 @@ class ModuleDict(object):
                           '"{}" must be torchx.nn.Module.'.format(m))
         self._module_dict = module_dict
 
-    def dumps(self):
+    def dumps(self, wire_dtype=None):
         """
             Dump content into binary
 
+        Args:
+            wire_dtype: None for full precision, 'fp16', 'bf16' or 'int8',
+                see encode_wire. load() and loads() decode it
+
         Returns:
             bytes
         """
+        numpy_dict = self.numpy_dict()
+        if wire_dtype is not None:
+            numpy_dict = encode_wire_params(numpy_dict, wire_dtype)
+        return U.serialize(numpy_dict)
+
+    def numpy_dict(self):
+        """
+        Returns:
+            {<module_dict_key>: state_dict with numpy arrays}
+        """
         bin_dict = {}
         for k, m in self._module_dict.items():
             state_dict = m.state_dict()
             for key in state_dict:
                 state_dict[key] = state_dict[key].cpu().numpy()
             bin_dict[k] = state_dict
-        return U.serialize(bin_dict)
+        return bin_dict
 
     def loads(self, binary):
         """
@@ -58,6 +73,6 @@ class ModuleDict(object):
         for key in numpy_dict:
             for k in numpy_dict[key]:
                 numpy_dict[key][k] = torch.from_numpy(
-                    np_cast(numpy_dict[key][k], np.float32))
+                    np_cast(decode_wire(numpy_dict[key][k]), np.float32))
         for k, m in self._module_dict.items():
             m.load_state_dict(numpy_dict[k])
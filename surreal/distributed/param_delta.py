@@ -0,0 +1,169 @@
+"""
+Encodings of published parameters: reduced precision wire dtypes,
+and delta encoding where the learner publishes a full copy of the
+parameters every few publishes and in between only the difference
+with what the agents hold.
+"""
+import numpy as np
+import surreal.utils as U
+
+
+def quantize_int8(array):
+    """
+    Symmetric linear quantization with one scale per array
+
+    Returns:
+        (int8 array, float32 scale)
+    """
+    array = np.asarray(array, dtype=np.float32)
+    max_abs = float(np.abs(array).max()) if array.size else 0.
+    scale = np.float32(max_abs / 127. if max_abs > 0 else 1.)
+    quantized = np.clip(np.rint(array / scale), -127, 127).astype(np.int8)
+    return quantized, scale
+
+
+def dequantize_int8(quantized, scale):
+    return quantized.astype(np.float32) * scale
+
+
+def encode_wire(array, wire_dtype):
+    """
+    Args:
+        array: np.array, only floating point arrays are encoded
+        wire_dtype: None (unchanged), 'fp16', 'bf16' (upper half of
+            the float32 bits, rounded) or 'int8' (one scale per array)
+
+    Returns:
+        what to send, decode_wire() turns it back into an array
+    """
+    if wire_dtype is None or not np.issubdtype(array.dtype, np.floating):
+        return array
+    if wire_dtype == 'fp16':
+        return array.astype(np.float16)
+    elif wire_dtype == 'bf16':
+        bits = np.ascontiguousarray(array, dtype=np.float32).view(np.uint32)
+        # round to nearest, ties to even
+        bits = bits + np.uint32(0x7FFF) + ((bits >> 16) & np.uint32(1))
+        return ('bf16', (bits >> 16).astype(np.uint16))
+    elif wire_dtype == 'int8':
+        return ('int8',) + quantize_int8(array)
+    else:
+        raise ValueError('Unknown wire dtype: {}'.format(wire_dtype))
+
+
+def decode_wire(value):
+    """
+    Returns:
+        the array encoded by encode_wire(), float32 if it was encoded.
+        fp16 arrays are not tagged, any float16 array is cast back
+    """
+    if not isinstance(value, tuple):
+        if isinstance(value, np.ndarray) and value.dtype == np.float16:
+            return value.astype(np.float32)
+        return value
+    if value[0] == 'bf16':
+        return (value[1].astype(np.uint32) << 16).view(np.float32)
+    elif value[0] == 'int8':
+        return dequantize_int8(value[1], value[2])
+    else:
+        raise ValueError('Unknown wire encoding: {}'.format(value[0]))
+
+
+def encode_wire_params(params, wire_dtype):
+    """
+    Args:
+        params: {module: {key: np.array}}, as dumped by ModuleDict
+    """
+    return {module: {key: encode_wire(value, wire_dtype)
+                     for key, value in state.items()}
+            for module, state in params.items()}
+
+
+def decode_wire_params(params):
+    """
+    Returns:
+        copy of the parameters encoded by encode_wire_params()
+    """
+    return {module: {key: np.array(decode_wire(value), copy=True)
+                     for key, value in state.items()}
+            for module, state in params.items()}
+
+
+def _decode(encoded):
+    """
+    Returns:
+        float32 difference encoded by ParameterDeltaEncoder
+    """
+    return decode_wire(encoded).astype(np.float32)
+
+
+def apply_delta(params, delta):
+    """
+    Updates params in place
+
+    Args:
+        params: {module: {key: np.array}}, as dumped by ModuleDict
+        delta: published by ParameterDeltaEncoder.encode
+    """
+    for module, state in delta.items():
+        for key, value in state.items():
+            if np.issubdtype(params[module][key].dtype, np.floating):
+                params[module][key] = params[module][key] + _decode(value)
+            else:
+                # e.g. batch norm counters are replaced
+                params[module][key] = value
+
+
+class ParameterDeltaEncoder(object):
+    """
+        Learner side. Differences are taken against the parameters as
+        the agents reconstruct them rather than against the previously
+        published ones, so that quantization errors are fed back into
+        the next delta instead of accumulating on the agents.
+    """
+    def __init__(self, full_interval, quantize=None, wire_dtype=None):
+        """
+        Args:
+            full_interval: every full_interval publishes, the full
+                parameters are sent and become the new base
+            quantize: wire dtype of the differences, see encode_wire
+            wire_dtype: wire dtype of the full parameters
+        """
+        self.full_interval = full_interval
+        self.quantize = quantize
+        self.wire_dtype = wire_dtype
+        # parameters as reconstructed by agents
+        self._reference = None
+        self._deltas_since_full = 0
+
+    def encode(self, params):
+        """
+        Args:
+            params: {module: {key: np.array}}, as dumped by ModuleDict
+
+        Returns:
+            (binary, is_full): binary is the serialized params encoded
+            by encode_wire_params if is_full, else the serialized delta
+            to apply with apply_delta
+        """
+        if (self._reference is None
+                or self._deltas_since_full >= self.full_interval - 1):
+            params = encode_wire_params(params, self.wire_dtype)
+            self._reference = decode_wire_params(params)
+            self._deltas_since_full = 0
+            return U.serialize(params), True
+        delta = {}
+        for module, state in params.items():
+            delta[module] = {}
+            for key, value in state.items():
+                reference = self._reference[module][key]
+                if not np.issubdtype(reference.dtype, np.floating):
+                    delta[module][key] = value
+                    self._reference[module][key] = np.array(value, copy=True)
+                    continue
+                encoded = encode_wire(
+                    (value - reference).astype(np.float32), self.quantize)
+                delta[module][key] = encoded
+                self._reference[module][key] = reference + _decode(encoded)
+        self._deltas_since_full += 1
+        return U.serialize(delta), False
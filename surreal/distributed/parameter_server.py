@@ -3,7 +3,7 @@
         updated parameters from the learner to agents
 """
 import time
-from multiprocessing import Process
+from multiprocessing import Process, Queue
 import os
 from caraml.zmq import (
     ZmqProxyThread,
@@ -14,6 +14,11 @@ from caraml.zmq import (
     ZmqTimeoutError)
 import surreal.utils as U
 from surreal.distributed.module_dict import ModuleDict
+from surreal.distributed.param_delta import (
+    ParameterDeltaEncoder,
+    apply_delta,
+    decode_wire_params,
+)
 # TODO: better logging for this file
 
 
@@ -22,11 +27,15 @@ class ParameterPublisher(object):
         Publishes parameters from the learner side
         Using ZmqPub socket
     """
-    def __init__(self, port, module_dict):
+    def __init__(self, port, module_dict, delta_config=None, wire_dtype=None):
         """
         Args:
             port: the port connected to the pub socket
             module_dict: ModuleDict object that exposes model parameters
+            delta_config: learner_config.parameter_publish.delta,
+                publishes full parameters every time if None or not enabled
+            wire_dtype: precision of the published parameters,
+                see ModuleDict.dumps
         """
         self._publisher = ZmqPub(
             host='*',
@@ -36,6 +45,15 @@ class ParameterPublisher(object):
         if not isinstance(module_dict, ModuleDict):
             module_dict = ModuleDict(module_dict)
         self._module_dict = module_dict
+        self._wire_dtype = wire_dtype
+        self._delta_encoder = None
+        if delta_config is not None and delta_config.enabled:
+            self._delta_encoder = ParameterDeltaEncoder(
+                full_interval=delta_config.full_interval,
+                quantize=delta_config.quantize,
+                wire_dtype=wire_dtype)
+        self._last_hash = None
+        self._base_hash = None
 
     def publish(self, iteration, message=''):
         """
@@ -45,35 +63,80 @@ class ParameterPublisher(object):
             iteration: current learning iteration
             message: any U.serialize serializable data
         """
-        binary = self._module_dict.dumps()
         info = {
             'time': time.time(),
             'iteration': iteration,
             'message': message,
-            'hash': U.binary_hash(binary)
         }
+        if self._delta_encoder is None:
+            binary = self._module_dict.dumps(wire_dtype=self._wire_dtype)
+            info['hash'] = U.binary_hash(binary)
+        else:
+            binary, is_full = self._delta_encoder.encode(
+                self._module_dict.numpy_dict())
+            if is_full:
+                info['hash'] = U.binary_hash(binary)
+                self._base_hash = info['hash']
+            else:
+                # chained, two identical deltas are different versions
+                info['hash'] = U.binary_hash(self._last_hash.encode() + binary)
+            info['delta'] = not is_full
+            # version the delta applies to
+            info['prev_hash'] = self._last_hash
+            info['base_hash'] = self._base_hash
+        self._last_hash = info['hash']
         self._publisher.pub(topic='ps', data=(binary, info))
 
 
 class ShardedParameterServer(object):
     """
         Runs multiple parameter servers in parallel
+        By default they subscribe to the learner. With relay_port, the
+        first shard relays what the learner publishes to parameter
+        servers further down the tree (see ParameterServer)
     """
-    def __init__(self, shards):
+    def __init__(self, shards,
+                 publisher_host=None, publisher_port=None,
+                 frontend_port=None, backend_port=None,
+                 notify_port=None, relay_port=None):
+        """
+        Args:
+            shards: number of parameter server processes
+            publisher_host, publisher_port: where to subscribe to
+                parameters, the learner if None. A relay parameter server
+                subscribes to the relay port of an upstream one
+            frontend_port, backend_port: where to serve agents,
+                the ps-frontend and ps-backend ports if None
+            notify_port: where to publish version notifications,
+                None to not publish them
+            relay_port: where the first shard republishes parameters
+                for downstream relays, None if there is none
+        """
         self.shards = shards
 
         # Serving parameter to agents
-        self.frontend_port = os.environ['SYMPH_PS_FRONTEND_PORT']
-        self.backend_port = os.environ['SYMPH_PS_BACKEND_PORT']
+        if frontend_port is None:
+            frontend_port = os.environ['SYMPH_PS_FRONTEND_PORT']
+            backend_port = os.environ['SYMPH_PS_BACKEND_PORT']
+        self.frontend_port = frontend_port
+        self.backend_port = backend_port
         self.serving_frontend_add = "tcp://*:{}".format(self.frontend_port)
         self.serving_backend_add = "tcp://*:{}".format(self.backend_port)
 
         # Subscribing to learner published parameters
-        self.publisher_host = os.environ['SYMPH_PARAMETER_PUBLISH_HOST']
-        self.publisher_port = os.environ['SYMPH_PARAMETER_PUBLISH_PORT']
+        if publisher_host is None:
+            publisher_host = os.environ['SYMPH_PARAMETER_PUBLISH_HOST']
+            publisher_port = os.environ['SYMPH_PARAMETER_PUBLISH_PORT']
+        self.publisher_host = publisher_host
+        self.publisher_port = publisher_port
+
+        self.notify_port = notify_port
+        self.relay_port = relay_port
 
         self.proxy = None
         self.workers = []
+        self._notify_queue = None
+        self._notify_thread = None
 
     def launch(self):
         """
@@ -86,6 +149,10 @@ class ShardedParameterServer(object):
                                     pattern='router-dealer')
         self.proxy.start()
 
+        if self.notify_port is not None:
+            self._notify_queue = Queue()
+            self._notify_thread = U.start_thread(self._notify_loop)
+
         self.workers = []
         for i in range(self.shards):
             worker = ParameterServer(
@@ -94,10 +161,30 @@ class ShardedParameterServer(object):
                 serving_host='localhost',
                 serving_port=self.backend_port,
                 load_balanced=True,
+                notify_queue=self._notify_queue,
+                # a single pub socket can bind the port
+                relay_port=self.relay_port if i == 0 else None,
             )
             worker.start()
             self.workers.append(worker)
 
+    def _notify_loop(self):
+        """
+            Publishes the version notifications of all the shards,
+            each version once, as soon as one of them serves it
+        """
+        notifier = ZmqPub(
+            host='*',
+            port=self.notify_port,
+            serializer=U.serialize,
+        )
+        last_time = None
+        while True:
+            notification = self._notify_queue.get(block=True)
+            if last_time is None or notification['time'] > last_time:
+                last_time = notification['time']
+                notifier.pub(topic='ps-notify', data=notification)
+
     def join(self):
         """
             Wait for all parameter server workers to exit
@@ -116,19 +203,40 @@ class ParameterServer(Process):
             model parameters and serves these parameters to agents
         It implements a simple hash based caching mechanism to avoid
             serving duplicate parameters to agent
+        When the learner publishes deltas (see ParameterDeltaEncoder),
+            it keeps the last full parameters and the chain of deltas
+            published since, and serves agents only the deltas
+            they are missing
+        With a notify queue, it reports every new version it serves
+            to ShardedParameterServer, which announces it to agents
+            on topic 'ps-notify' so that they only send requests
+            when there is something to fetch
+        Replies are serialized once per published version and the same
+            bytes are sent to every agent asking for them
+        With a relay port, it republishes everything it receives
+            verbatim on topic 'ps', so that downstream parameter servers
+            can subscribe to it as they would to the learner. This forms
+            a tree in which the learner only sends parameters to the
+            first tier
     """
     def __init__(self,
                  publisher_host,
                  publisher_port,
                  serving_host,
                  serving_port,
-                 load_balanced=False,):
+                 load_balanced=False,
+                 notify_queue=None,
+                 relay_port=None):
         """
         Args:
             publisher_host, publisher_port: where learner publish parameters
             serving_host, serving_port: where to serve parameters to agents
             load_balanced: whether multiple parameter servers are sharing the
                 same address
+            notify_queue: multiprocessing queue to report new versions to,
+                None to not report them
+            relay_port: where to republish parameters for downstream
+                parameter servers, None to not relay them
         """
         Process.__init__(self)
         self.publisher_host = publisher_host
@@ -136,11 +244,24 @@ class ParameterServer(Process):
         self.serving_host = serving_host
         self.serving_port = serving_port
         self.load_balanced = load_balanced
+        self.notify_queue = notify_queue
+        self.relay_port = relay_port
         # storage
         self.parameters = None
         self.param_info = None
+        # with delta publishing: [(info, binary)] published since
+        # the full parameters in self.parameters
+        self._deltas = []
+        self._delta_chain_broken = False
+        # (param_info, parameters, deltas) being served, replaced
+        # at once so that agent requests see a consistent version
+        self._served = (None, None, [])
+        # {(version hash, reply key): serialized reply}, replaced
+        # whenever a new version is served
+        self._reply_cache = {}
         # threads
         self._subscriber = None
+        self._relay = None
         self._server = None
         self._subscriber_thread = None
         self._server_thread = None
@@ -152,20 +273,26 @@ class ParameterServer(Process):
         self._subscriber = ZmqSub(
             host=self.publisher_host,
             port=self.publisher_port,
-            # handler=self._set_storage,
+            # handler=self._on_publish,
             topic='ps',
-            deserializer=U.deserialize,
+            # relayed as received, deserialized by _on_publish
         )
         self._server = ZmqServer(
             host=self.serving_host,
             port=self.serving_port,
             # handler=self._handle_agent_request,
-            serializer=U.serialize,
+            # replies are serialized by _handle_agent_request
             deserializer=U.deserialize,
             bind=not self.load_balanced,
         )
+        # only used by the subscriber thread
+        if self.relay_port is not None:
+            self._relay = ZmqPub(
+                host='*',
+                port=self.relay_port,
+            )
         self._subscriber_thread = self._subscriber.start_loop(
-            handler=self._set_storage,
+            handler=self._on_publish,
             blocking=False)
         self._server_thread = self._server.start_loop(
             handler=self._handle_agent_request,
@@ -175,8 +302,88 @@ class ParameterServer(Process):
         self._subscriber_thread.join()
         self._server_thread.join()
 
+    def _on_publish(self, message):
+        if self._relay is not None:
+            # downstream servers check delta chains themselves
+            self._relay.pub(topic='ps', data=message)
+        self._set_storage(U.deserialize(message))
+
     def _set_storage(self, data):
-        self.parameters, self.param_info = data
+        binary, info = data
+        if not info.get('delta'):
+            self.parameters, self.param_info = binary, info
+            self._deltas = []
+            self._delta_chain_broken = False
+            self._serve()
+            return
+        if (self.param_info is None or self._delta_chain_broken
+                or info['prev_hash'] != self.param_info['hash']):
+            # joined in the middle of a chain or missed a message,
+            # serve the current version until the next full parameters
+            self._delta_chain_broken = True
+            return
+        # a new list, requests being answered hold the previous one
+        self._deltas = self._deltas + [(info, binary)]
+        self.param_info = info
+        self._serve()
+
+    def _serve(self):
+        self._served = (self.param_info, self.parameters, self._deltas)
+        self._reply_cache = {}
+        self._notify()
+
+    def _notify(self):
+        """
+            Tells agents that a new version is being served
+        """
+        if self.notify_queue is None:
+            return
+        self.notify_queue.put({
+            'hash': self.param_info['hash'],
+            'iteration': self.param_info['iteration'],
+            'time': self.param_info['time'],
+        })
+
+    def _delta_start(self, deltas, last_hash):
+        """
+        Returns:
+            index of the first delta an agent holding last_hash misses,
+            None if it does not hold a version of the current chain
+        """
+        hashes = [deltas[0][0]['prev_hash']] if deltas else []
+        hashes += [info['hash'] for info, _ in deltas]
+        if last_hash in hashes:
+            return hashes.index(last_hash)
+        return None
+
+    def _delta_reply(self, parameters, deltas, start):
+        """
+        Returns:
+            {'base': full parameters or None, 'deltas': [binary]},
+            only the deltas from start if it is not None
+        """
+        if start is not None:
+            return {
+                'base': None,
+                'deltas': [binary for _, binary in deltas[start:]],
+            }
+        return {
+            'base': parameters,
+            'deltas': [binary for _, binary in deltas],
+        }
+
+    def _cached_reply(self, info, key, make_reply):
+        """
+        Returns:
+            make_reply() serialized, computed once per version
+        """
+        # the subscriber thread may replace the cache meanwhile,
+        # keys carry the version so that entries are never mixed up
+        cache = self._reply_cache
+        key = (info['hash'], key)
+        if key not in cache:
+            cache[key] = U.serialize(make_reply())
+        return cache[key]
 
     def _handle_agent_request(self, request):
         """
@@ -191,21 +398,34 @@ class ParameterServer(Process):
                 returns (None, info) if the hash
                     of server side parameters is the same as the agent's
                 otherwise returns (param, info)
+            With delta publishing ('base_hash' in info),
+                param is a dict, see _delta_reply
+
+        Returns:
+            the reply, serialized
         """
+        info, parameters, deltas = self._served
         if request == 'info':
-            return None, self.param_info
+            if info is None:
+                return U.serialize((None, None))
+            return self._cached_reply(info, 'info', lambda: (None, info))
         elif request.startswith('parameter'):
-            if self.parameters is None:
-                return None, None
+            if parameters is None:
+                return U.serialize((None, None))
+            last_hash = None
             if ':' in request:
                 _, last_hash = request.split(':', 1)
-                current_hash = self.param_info['hash']
-                if last_hash == current_hash:  # param not changed
-                    return None, self.param_info
-                else:
-                    return self.parameters, self.param_info
-            else:
-                return self.parameters, self.param_info
+                if last_hash == info['hash']:  # param not changed
+                    return self._cached_reply(info, 'info',
+                                              lambda: (None, info))
+            if 'base_hash' in info:
+                start = self._delta_start(deltas, last_hash)
+                return self._cached_reply(
+                    info, ('delta', start),
+                    lambda: (self._delta_reply(parameters, deltas, start),
+                             info))
+            return self._cached_reply(info, 'parameter',
+                                      lambda: (parameters, info))
         else:
             raise ValueError('invalid request: '+str(request))
 
@@ -214,15 +434,25 @@ class ParameterClient(object):
     """
         On agent side, sends requests to parameter servers to fetch the
         latest parameters.
+        With notify_port, subscribes to the version notifications of
+        the parameter servers and only sends a request when a version
+        newer than the one it holds has been announced, or when it has
+        not sent one for poll_interval seconds in case notifications
+        were lost
     """
 
-    def __init__(self, host, port, timeout=2):
+    def __init__(self, host, port, timeout=2,
+                 notify_host=None, notify_port=None, poll_interval=30):
         """
         Args:
             host: parameter server host
             port: parameter server port
             timeout: how long should the the client wait
                 if the parameter server is not available
+            notify_host, notify_port: where parameter servers publish
+                version notifications, None to request every time
+            poll_interval: with notifications, longest time in seconds
+                without sending a request
         """
         self.host = host
         self.port = port
@@ -230,6 +460,27 @@ class ParameterClient(object):
         self._current_info = {}
         self._last_hash = ''
         self.alive = False
+        # with delta publishing, the parameters reconstructed so far
+        self._params = None
+        # learner publish time of the version served last
+        # and of the latest version announced
+        self._fetched_time = None
+        self._notified_time = None
+        # local time of the last request
+        self._request_time = None
+        self.poll_interval = poll_interval
+        self._notify_sub = None
+        self._notify_thread = None
+        if notify_port is not None:
+            self._notify_sub = ZmqSub(
+                host=notify_host,
+                port=notify_port,
+                topic='ps-notify',
+                deserializer=U.deserialize,
+            )
+            self._notify_thread = self._notify_sub.start_loop(
+                handler=self._on_notify,
+                blocking=False)
 
         self._client = ZmqClient(
             host=self.host,
@@ -250,8 +501,13 @@ class ParameterClient(object):
                 currently cached hash
 
         Returns:
-            (param or None, info or None)
+            (param or None, info or None), param is serialized as
+            ModuleDict.dumps() unless the parameter server sent deltas,
+            then it is the deserialized dict
         """
+        if not force_update and not self.update_pending():
+            return None, None
+        self._request_time = time.time()
         try:
             if force_update:
                 response = self._client.request('parameter')
@@ -264,10 +520,49 @@ class ParameterClient(object):
         param, info = response
         if info is None:
             return None, None
+        self._fetched_time = info['time']
+        if param is not None and 'base_hash' in info:
+            param = self._apply_deltas(param)
 
         self._last_hash = info['hash']
         return param, info
 
+    def _on_notify(self, notification):
+        if (self._notified_time is None
+                or notification['time'] > self._notified_time):
+            self._notified_time = notification['time']
+
+    def update_pending(self):
+        """
+        Returns:
+            False if notifications are enabled, no version newer than
+            the one served last has been announced and a request was
+            sent less than poll_interval seconds ago, True otherwise
+        """
+        if self._notify_sub is None or self._fetched_time is None:
+            return True
+        if time.time() - self._request_time > self.poll_interval:
+            # notifications can be dropped
+            return True
+        return (self._notified_time is not None
+                and self._notified_time > self._fetched_time)
+
+    def _apply_deltas(self, reply):
+        """
+        Args:
+            reply: see ParameterServer._delta_reply
+
+        Returns:
+            the reconstructed parameters, already deserialized.
+            The dicts are copies, the arrays are shared and
+            must not be modified in place
+        """
+        if reply['base'] is not None:
+            self._params = decode_wire_params(U.deserialize(reply['base']))
+        for binary in reply['deltas']:
+            apply_delta(self._params, U.deserialize(binary))
+        return {module: dict(state) for module, state in self._params.items()}
+
     def fetch_info(self):
         """
             Fetch the metadata of parameters on parameter server
@@ -0,0 +1,65 @@
+"""
+    Sends new priorities computed by the learner back to the
+        prioritized replay shards
+"""
+import queue
+import numpy as np
+from caraml.zmq import ZmqPub
+import surreal.utils as U
+
+
+def priority_update_topic(shard):
+    """
+    Topic a replay shard subscribes to.
+    The trailing '/' keeps 'replay-1' from matching 'replay-10'
+    """
+    return 'replay-{}/'.format(shard)
+
+
+class PriorityUpdatePublisher(object):
+    """
+        Publishes (indices, priorities) to replay shards
+        Using ZmqPub socket, from a background thread so that
+        the learner never waits on the network
+    """
+    def __init__(self, port):
+        """
+        Args:
+            port: the port the pub socket binds to
+        """
+        self.port = port
+        self._queue = queue.Queue()
+        self._thread = U.start_thread(self._publish_loop)
+
+    def publish(self, shards, indices, priorities, generations):
+        """
+        Called by learner, returns immediately.
+
+        Args:
+            shards: shard id of each sampled experience
+            indices: index of each experience in its shard
+            priorities: new priority of each experience
+            generations: compaction generation of its shard when
+                each experience was sampled
+        """
+        self._queue.put((shards, indices, priorities, generations))
+
+    def _publish_loop(self):
+        # zmq sockets must be used by the thread that created them
+        publisher = ZmqPub(
+            host='*',
+            port=self.port,
+            serializer=U.serialize,
+        )
+        while True:
+            shards, indices, priorities, generations = \
+                self._queue.get(block=True)
+            shards = np.asarray(shards)
+            indices = np.asarray(indices)
+            priorities = np.asarray(priorities, dtype=np.float64)
+            generations = np.asarray(generations)
+            for shard in np.unique(shards):
+                mask = shards == shard
+                publisher.pub(topic=priority_update_topic(shard),
+                              data=(indices[mask], priorities[mask],
+                                    generations[mask]))
@@ -0,0 +1,134 @@
+"""
+    Shared memory ring through which co-located replay shards hand
+    sampled batches to the learner. Only a small descriptor
+    goes through the sampler sockets.
+"""
+import os
+import glob
+import threading
+import numpy as np
+import psutil
+import surreal.utils as U
+
+SHM_FOLDER = '/dev/shm'
+# the header holds the number of bytes reserved since the ring was created
+_HEADER_BYTES = 8
+
+
+class ShmRingWriter(object):
+    """
+        Replay side of the ring, used by all the sampler workers of a shard.
+        Readers can map the ring read-only: a reader detects that the
+        batch it copied was overwritten meanwhile through the header,
+        see read_shm_ring().
+    """
+    def __init__(self, prefix, capacity):
+        """
+        Args:
+            prefix: the ring is the file prefix-<pid> in SHM_FOLDER,
+                rings with the same prefix whose process is gone are
+                deleted first
+            capacity: ring size in bytes, must hold the largest batch
+        """
+        remove_stale_rings(prefix)
+        self.path = os.path.join(SHM_FOLDER, '{}-{}'.format(prefix, os.getpid()))
+        self.capacity = capacity
+        self._file = np.memmap(self.path, dtype=np.uint8, mode='w+',
+                               shape=(_HEADER_BYTES + capacity,))
+        self._reserved = self._file[:_HEADER_BYTES].view(np.int64)
+        self._ring = self._file[_HEADER_BYTES:]
+        self._position = 0
+        self._lock = threading.Lock()
+
+    def write(self, data):
+        """
+        Copies the serialized batch into the ring
+
+        Args:
+            data: bytes-like
+
+        Returns:
+            descriptor to send to the reader
+        """
+        data = np.frombuffer(data, dtype=np.uint8)
+        size = len(data)
+        if size > self.capacity:
+            raise ValueError('Batch of {} bytes does not fit in the shared '
+                             'memory ring of {} bytes, increase session_config'
+                             '.replay.shm_ring_bytes'.format(size, self.capacity))
+        with self._lock:
+            position = self._position
+            if position % self.capacity + size > self.capacity:
+                # batches are contiguous, start over at the beginning
+                position += self.capacity - position % self.capacity
+            self._position = position + size
+            self._reserved[0] = self._position
+        offset = position % self.capacity
+        # writers own disjoint regions unless the ring is lapped,
+        # which readers detect
+        self._ring[offset:offset + size] = data
+        return {
+            'path': self.path,
+            'position': position,
+            'size': size,
+        }
+
+    def close(self):
+        del self._reserved, self._ring, self._file
+        U.f_remove(self.path)
+
+
+def remove_stale_rings(prefix):
+    """
+    Deletes the rings left behind by writers that were killed
+    before they could close them
+
+    Args:
+        prefix: see ShmRingWriter
+    """
+    for path in glob.glob(os.path.join(SHM_FOLDER, glob.escape(prefix) + '-*')):
+        pid = path[len(os.path.join(SHM_FOLDER, prefix)) + 1:]
+        if pid.isdigit() and not psutil.pid_exists(int(pid)):
+            U.f_remove(path)
+
+
+_readers = {}
+
+
+def read_shm_ring(descriptor):
+    """
+    Copies a batch out of a ring mapped read-only.
+
+    Args:
+        descriptor: returned by ShmRingWriter.write
+
+    Returns:
+        the bytes written, None if the writer has lapped the ring
+        and overwritten them before they were copied
+    """
+    path = descriptor['path']
+    if path not in _readers:
+        _readers[path] = np.memmap(path, dtype=np.uint8, mode='r')
+    ring_file = _readers[path]
+    reserved = ring_file[:_HEADER_BYTES].view(np.int64)
+    capacity = len(ring_file) - _HEADER_BYTES
+    position = descriptor['position']
+    offset = _HEADER_BYTES + position % capacity
+    data = ring_file[offset:offset + descriptor['size']].tobytes()
+    if reserved[0] > position + capacity:
+        return None
+    return data
+
+
+def shm_ring_deserialize(reply):
+    """
+    Deserializer of the learner prefetcher for replies sent
+    through the ring.
+    Batches overwritten before they could be read become None,
+    like replies of a replay that is not ready to sample.
+    """
+    descriptor = U.deserialize(reply)
+    data = read_shm_ring(descriptor)
+    if data is None:
+        return None
+    return U.deserialize(data)
@@ -306,3 +306,129 @@ class ExpSenderWrapperMultiStepMovingWindow(ExpSenderWrapperMultiStep):
                     self.last_n.popleft()
         self._obs = obs_next
         return obs_next, reward, done, info
+
+
+class ExpSenderWrapperTrajectory(ExpSenderWrapperBase):
+    """
+        Sends each step once, in segments of a trajectory
+        {
+            'obs': [state_1, ..., state_L]
+            'obs_next': state_{L + 1}
+            'actions': [action_1, ...],
+            'rewards': [reward_1, ...],
+            'dones': [done_1, ...],
+            'infos': [info_1, ...],
+            'start': index of state_1 in the episode,
+        }
+        TrajectoryReplay materializes the n-step windows at sample time.
+        Consecutive segments overlap by the few steps needed for every
+        window to lie within a single segment.
+
+        Requires:
+            @self.learner_config.replay.trajectory.segment_length: L
+            @self.learner_config.replay.trajectory.window_format:
+                windows start every @self.learner_config.algo.stride steps
+                for 'multistep', at every step for 'ssar'
+            @self.learner_config.algo.n_step: n, number of steps per window
+    """
+    with_info = False
+
+    def __init__(self, env, learner_config, session_config):
+        super().__init__(env, learner_config, session_config)
+        self._ob = None  # obs of the current time step
+        self.n_step = self.learner_config.algo.n_step
+        self.segment_length = self.learner_config.replay.trajectory.segment_length
+        if self.learner_config.replay.trajectory.window_format == 'multistep':
+            self.stride = self.learner_config.algo.stride
+        else:
+            self.stride = 1
+        if self.stride < 1:
+            raise ConfigError('stride {} for experience generation cannot be less than 1'.format(self.stride))
+        if self.segment_length < self.n_step:
+            raise ConfigError('trajectory segment_length {} cannot be less than n_step {}'.format(
+                self.segment_length, self.n_step))
+        # like the moving window, a stride past n_step starts the next window right away
+        self.stride = min(self.stride, self.n_step)
+        self._steps = []
+        self._start = 0  # index of self._steps[0] in the episode
+
+    def _reset(self):
+        '''
+            Note: deepcopy is required to prevent Mujoco changing the states
+                  under the hood
+        '''
+        obs, info = self.env.reset()
+        self._ob = copy.deepcopy(obs)
+        self._steps = []
+        self._start = 0
+        return self._ob, info
+
+    def _split_action(self, action):
+        '''
+            Returns action_choice, onetime_info, persistent_info
+        '''
+        return action, None, None
+
+    def _step(self, action):
+        action_choice, onetime_info, persistent_info = self._split_action(action)
+        obs_next, reward, done, info = self.env.step(action_choice)
+        self._steps.append([self._ob, action_choice, reward, done,
+                            onetime_info, persistent_info, info])
+
+        if done:
+            if len(self._steps) >= self.n_step:
+                self.send(self._steps, obs_next)
+            self._steps = []
+        elif len(self._steps) == self.segment_length:
+            self.send(self._steps, obs_next)
+            # the next segment starts at the first window not
+            # contained in this one
+            end = self._start + len(self._steps)
+            next_start = -(-(end - self.n_step + 1) // self.stride) * self.stride
+            self._steps = self._steps[next_start - self._start:]
+            self._start = next_start
+        self._ob = copy.deepcopy(obs_next)
+        return obs_next, reward, done, info
+
+    def send(self, data, obs_next):
+        '''
+            Sends a trajectory segment to distributed replay buffer
+            Args:
+                data: list of steps in the segment
+                obs_next: observation after the last step
+        '''
+        obs, actions, rewards, dones, onetime_infos, persistent_infos, infos = \
+            [list(field) for field in zip(*data)]
+        hash_dict = {
+            'obs': obs,
+            'obs_next': obs_next,
+        }
+        nonhash_dict = {
+            'actions': actions,
+            'rewards': rewards,
+            'dones': dones,
+            'infos': infos,
+            'start': self._start,
+        }
+        if self.with_info:
+            nonhash_dict['onetime_infos'] = onetime_infos
+            nonhash_dict['persistent_infos'] = persistent_infos
+        self.sender.send(hash_dict, nonhash_dict)
+
+
+class ExpSenderWrapperTrajectoryWithInfo(ExpSenderWrapperTrajectory):
+    """
+        Same as ExpSenderWrapperTrajectory, for agents whose actions are
+        (action_choice, (onetime_info, persistent_info)), see
+        ExpSenderWrapperMultiStepMovingWindowWithInfo. Segments also contain
+        {
+            'onetime_infos': [onetime_info_1, ...],
+            'persistent_infos': [persistent_info_1, ...],
+        }
+        the onetime info of every step is kept as any step can start a window
+    """
+    with_info = True
+
+    def _split_action(self, action):
+        action_choice, action_info = action
+        return action_choice, action_info[0], action_info[1]
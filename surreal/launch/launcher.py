@@ -132,6 +132,7 @@ class SurrealDefaultLauncher(Launcher):
                                 replay,
                                 learner,
                                 ps,
+                                ps_relay,
                                 tensorboard,
         """
         if '-' in component_name_in:
@@ -157,6 +158,8 @@ class SurrealDefaultLauncher(Launcher):
             self.run_learner()
         elif component_name == 'ps':
             self.run_ps()
+        elif component_name == 'ps_relay':
+            self.run_ps_relay()
         elif component_name == 'replay':
             self.run_replay()
         elif component_name == 'replay_loadbalancer':
@@ -338,7 +341,30 @@ class SurrealDefaultLauncher(Launcher):
         """
         ps_config = self.session_config.ps
 
-        server = ShardedParameterServer(shards=ps_config.shards)
+        server = ShardedParameterServer(
+            shards=ps_config.shards,
+            notify_port=os.environ.get('SYMPH_PS_NOTIFY_PORT'),
+            # only bound when a ps_relay is launched, see setup_network
+            relay_port=os.environ.get('SYMPH_PS_RELAY_PORT'))
+
+        server.launch()
+        server.join()
+
+    def run_ps_relay(self):
+        """
+            Launches a parameter server that subscribes to the parameters
+            republished by the first shard of ps instead of the learner.
+            Agents placed next to it fetch from it, see setup_network
+        """
+        ps_config = self.session_config.ps
+
+        server = ShardedParameterServer(
+            shards=ps_config.shards,
+            publisher_host=os.environ['SYMPH_PS_RELAY_HOST'],
+            publisher_port=os.environ['SYMPH_PS_RELAY_PORT'],
+            frontend_port=os.environ['SYMPH_PS_RELAY_FRONTEND_PORT'],
+            backend_port=os.environ['SYMPH_PS_RELAY_BACKEND_PORT'],
+            notify_port=os.environ.get('SYMPH_PS_RELAY_NOTIFY_PORT'))
 
         server.launch()
         server.join()
@@ -362,7 +388,9 @@ class SurrealDefaultLauncher(Launcher):
             Launches the learner and agent facing load balancing proxys
             for replays
         """
-        loadbalancer = ReplayLoadBalancer()
+        loadbalancer = ReplayLoadBalancer(
+            weighted_sampling=self.learner_config.replay.weighted_sampling,
+            shards=self.learner_config.replay.replay_shards)
         loadbalancer.launch()
         loadbalancer.join()
 
@@ -8,7 +8,8 @@ def setup_network(*, agents,
                   learner,
                   tensorplex,
                   loggerplex,
-                  tensorboard):
+                  tensorboard,
+                  ps_relay=None):
     """
         Sets up the communication between surreal
         components using symphony
@@ -17,28 +18,48 @@ def setup_network(*, agents,
             agents, evals (list): list of symphony processes
             ps, replay, learner, tensorplex, loggerplex, tensorboard:
                 symphony processes
+            ps_relay: symphony process of the ps_relay component, None
+                if agents fetch parameters from ps directly
     """
     for proc in itertools.chain(agents, evals):
-        proc.connects('ps-frontend')
+        if ps_relay is None:
+            proc.connects('ps-frontend')
+            proc.connects('ps-notify')
+        else:
+            proc.connects('ps-relay-frontend')
+            proc.connects('ps-relay-notify')
         proc.connects('collector-frontend')
 
     ps.binds('ps-frontend')
     ps.binds('ps-backend')
+    ps.binds('ps-notify')
     ps.connects('parameter-publish')
 
+    if ps_relay is not None:
+        ps.binds('ps-relay')
+        ps_relay.connects('ps-relay')
+        ps_relay.binds('ps-relay-frontend')
+        ps_relay.binds('ps-relay-backend')
+        ps_relay.binds('ps-relay-notify')
+
     replay.binds('collector-frontend')
     replay.binds('sampler-frontend')
     replay.binds('collector-backend')
     replay.binds('sampler-backend')
+    replay.connects('priority-update')
 
     learner.connects('sampler-frontend')
     learner.binds('parameter-publish')
     learner.binds('prefetch-queue')
+    learner.binds('priority-update')
 
     tensorplex.binds('tensorplex')
     loggerplex.binds('loggerplex')
 
-    for proc in itertools.chain(agents, evals, [ps, replay, learner]):
+    servers = [ps, replay, learner]
+    if ps_relay is not None:
+        servers.append(ps_relay)
+    for proc in itertools.chain(agents, evals, servers):
         proc.connects('tensorplex')
         proc.connects('loggerplex')
 
@@ -35,6 +35,13 @@ def create_surreal_containerized(exp,
         container_image=nonagent_image,
         args=[cmd_dict['ps']])
 
+    ps_relay = None
+    if 'ps_relay' in cmd_dict:
+        ps_relay = nonagent.new_process(
+            'ps_relay',
+            container_image=nonagent_image,
+            args=[cmd_dict['ps_relay']])
+
     tensorboard = nonagent.new_process(
         'tensorboard',
         container_image=nonagent_image,
@@ -82,13 +89,15 @@ def create_surreal_containerized(exp,
                   ps=ps,
                   tensorboard=tensorboard,
                   tensorplex=tensorplex,
-                  loggerplex=loggerplex)
+                  loggerplex=loggerplex,
+                  ps_relay=ps_relay)
     return {
         'agents': agents,
         'evals': evals,
         'learner': learner,
         'replay': replay,
         'ps': ps,
+        'ps_relay': ps_relay,
         'tensorboard': tensorboard,
         'tensorplex': tensorplex,
         'loggerplex': loggerplex
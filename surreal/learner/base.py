@@ -15,7 +15,11 @@ from surreal.session import (
     get_tensorplex_client,
     Config
 )
-from surreal.distributed import ParameterPublisher, LearnerDataPrefetcher
+from surreal.distributed import (
+    ParameterPublisher,
+    LearnerDataPrefetcher,
+    PriorityUpdatePublisher,
+)
 
 
 class Learner(metaclass=U.AutoInitializeMeta):
@@ -39,6 +43,8 @@ class Learner(metaclass=U.AutoInitializeMeta):
         self.env_config = env_config
         self.session_config = session_config
         self.current_iter = 0
+        # Created on the first priority update, i.e. only with PrioritizedReplay
+        self._priority_publisher = None
 
         self._setup_logging()
         self._setup_checkpoint()
@@ -95,8 +101,10 @@ class Learner(metaclass=U.AutoInitializeMeta):
         ps_publish_port = os.environ['SYMPH_PARAMETER_PUBLISH_PORT']
         self._ps_publisher = ParameterPublisher(
             port=ps_publish_port,
-            module_dict=self.module_dict()
+            module_dict=self.module_dict(),
             # This must happen after subclass __init__
+            delta_config=self.learner_config.parameter_publish.delta,
+            wire_dtype=self.learner_config.parameter_publish.wire_dtype,
         )
 
     def _setup_prefetching(self):
@@ -104,7 +112,7 @@ class Learner(metaclass=U.AutoInitializeMeta):
         self._prefetch_queue = LearnerDataPrefetcher(
             session_config=self.session_config,
             batch_size=batch_size,
-            worker_preprocess=self._prefetcher_preprocess,
+            worker_preprocess=self._worker_preprocess,
             main_preprocess=self.preprocess
         )
         self._prefetch_queue.start()
@@ -143,6 +151,28 @@ class Learner(metaclass=U.AutoInitializeMeta):
         """
         self._ps_publisher.publish(iteration, message=message)
 
+    ######
+    # Prioritized replay
+    ######
+    def update_replay_priorities(self, replay_info, td_errors):
+        """
+        Sends new priorities of a sampled batch back to the replay shards
+        it was sampled from. Returns immediately.
+
+        Args:
+            replay_info: batch.replay_info attached by PrioritizedReplay
+            td_errors: numpy array, one td error per experience
+        """
+        if self._priority_publisher is None:
+            self._priority_publisher = PriorityUpdatePublisher(
+                port=os.environ['SYMPH_PRIORITY_UPDATE_PORT'])
+        eps = self.learner_config.replay.prioritized.eps
+        priorities = np.abs(np.reshape(td_errors, -1)) + eps
+        self._priority_publisher.publish(replay_info['shard'],
+                                         replay_info['indices'],
+                                         priorities,
+                                         replay_info['generation'])
+
     ######
     # Getting data
     ######
@@ -341,6 +371,21 @@ class Learner(metaclass=U.AutoInitializeMeta):
         """
         return batch
 
+    def _worker_preprocess(self, batch):
+        """
+            PrioritizedReplay wraps experiences with their replay_info,
+            which has to survive _prefetcher_preprocess
+            None means the replay was not ready to sample
+        """
+        if batch is None:
+            return None
+        if isinstance(batch, dict) and 'replay_info' in batch:
+            replay_info = batch['replay_info']
+            batch = self._prefetcher_preprocess(batch['exps'])
+            batch['replay_info'] = replay_info
+            return batch
+        return self._prefetcher_preprocess(batch)
+
     ######
     # Main Loop
     # Override to completely change learner behavior
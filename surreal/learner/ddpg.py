@@ -226,6 +226,12 @@ class DDPGLearner(Learner):
             rewards = torch.tensor(rewards, dtype=torch.float32).to(torch.device(device_name))
             done = torch.tensor(done, dtype=torch.float32).to(torch.device(device_name))
 
+            if 'replay_info' in batch:
+                # importance sampling weights from PrioritizedReplay
+                weights = batch['replay_info']['weights']
+                batch['replay_info']['weights'] = (torch.tensor(weights, dtype=torch.float32)
+                    .to(torch.device(device_name))).view(-1, 1)
+
             (
                 batch['obs'],
                 batch['actions'],
@@ -241,7 +247,7 @@ class DDPGLearner(Learner):
             )
             return batch
 
-    def _optimize(self, obs, actions, rewards, obs_next, done):
+    def _optimize(self, obs, actions, rewards, obs_next, done, weights=None):
         '''
         Note that while the replay contains uint8, the
         aggregator returns float32 tensors
@@ -254,6 +260,11 @@ class DDPGLearner(Learner):
             rewards: rewards received after action is taken. Dimensionality: N
             obs_next: an observation from the minibatch, often represented as s_{n+1} in literature
             done: 1 if obs_next is terminal, 0 otherwise. Dimensionality: N
+            weights: importance sampling weights when sampled from a prioritized replay, None otherwise.
+                Dimensionality: (N, 1)
+
+        Returns:
+            tensorplex_update_dict, td_error of the critic as a numpy array
         '''
         with tx.device_scope(self.gpu_ids):
 
@@ -303,7 +314,7 @@ class DDPGLearner(Learner):
                 self.model.critic.zero_grad()
                 if self.is_pixel_input:
                     self.model.perception.zero_grad()
-                critic_loss = self.critic_criterion(y_policy, y)        
+                critic_loss = self._critic_loss(y_policy, y, weights)
                 critic_loss.backward()
                 if self.clip_critic_gradient:
                     self.model.critic.clip_grad_value(self.critic_gradient_clip_value)
@@ -313,7 +324,7 @@ class DDPGLearner(Learner):
                     self.model2.critic.zero_grad()
                     if self.is_pixel_input:
                         self.model2.perception.zero_grad()
-                    critic_loss = self.critic_criterion(y_policy2, y)
+                    critic_loss = self._critic_loss(y_policy2, y, weights)
                     critic_loss.backward()
                     if self.clip_critic_gradient:
                         self.model2.critic.clip_grad_value(self.critic_gradient_clip_value)
@@ -349,7 +360,13 @@ class DDPGLearner(Learner):
             # (possibly) update target networks
             self._target_update()
 
-            return tensorplex_update_dict
+            td_error = (y_policy - y).detach().cpu().numpy()
+            return tensorplex_update_dict, td_error
+
+    def _critic_loss(self, y_policy, y, weights):
+        if weights is None:
+            return self.critic_criterion(y_policy, y)
+        return (weights * (y_policy - y) ** 2).mean()
 
     def learn(self, batch):
         '''
@@ -360,14 +377,18 @@ class DDPGLearner(Learner):
             tensors and aggregation step
         '''
         self.current_iteration += 1
+        replay_info = batch.get('replay_info')
         with self.total_learn_time.time():
-            tensorplex_update_dict = self._optimize(
+            tensorplex_update_dict, td_error = self._optimize(
                 batch.obs,
                 batch.actions,
                 batch.rewards,
                 batch.obs_next,
-                batch.dones
+                batch.dones,
+                weights=None if replay_info is None else replay_info.weights,
             )
+            if replay_info is not None:
+                self.update_replay_priorities(replay_info, td_error)
             tensorplex_update_dict['performance/total_learn_time'] = self.total_learn_time.avg
             self.tensorplex.add_scalars(tensorplex_update_dict, global_step=self.current_iteration)
             self.periodic_checkpoint(
@@ -433,7 +454,10 @@ class DDPGLearner(Learner):
         If frame_stack_preprocess is not set, each experience in the replay will be stored as a list of frames, as
         opposed to a single numpy array.  We must condense them into a single numpy array as that is what the
         aggregator expects.
+        Columnar replay storage and replay side aggregation already send aggregated batches.
         '''
+        if isinstance(batch, dict):
+            return batch
         if not self.frame_stack_concatenate_on_env:
             batch = self.frame_stack_preprocess.preprocess_list(batch)
         batch = self.aggregator.aggregate(batch)
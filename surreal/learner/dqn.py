@@ -73,7 +73,14 @@ class DQNLearner(Learner):
         return td_error
 
     def learn(self, batch_exp):
-        weights = (U.torch_ones_like(batch_exp.rewards))
+        replay_info = batch_exp.get('replay_info')
+        if replay_info is None:
+            weights = (U.torch_ones_like(batch_exp.rewards))
+        else:
+            # importance sampling weights from PrioritizedReplay
+            weights = torch.tensor(replay_info.weights,
+                                   dtype=torch.float32,
+                                   device=batch_exp.rewards.device).view(-1, 1)
         td_errors = self._optimize(
             batch_exp.obs,
             batch_exp.actions,
@@ -82,6 +89,9 @@ class DQNLearner(Learner):
             batch_exp.dones,
             weights,
         )
+        if replay_info is not None:
+            self.update_replay_priorities(
+                replay_info, td_errors.detach().cpu().numpy())
         batch_size = batch_exp.obs.size(0)
         if self.target_update_tracker.track_increment(batch_size):
             # Update target network periodically.
@@ -678,5 +678,8 @@ class PPOLearner(Learner):
         ]
 
     def _prefetcher_preprocess(self, batch):
+        # already aggregated if learner_config.replay.aggregator is set
+        if isinstance(batch, dict):
+            return batch
         batch = self.aggregator.aggregate(batch)
         return batch
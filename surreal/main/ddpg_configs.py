@@ -7,7 +7,7 @@ from surreal.session import (
     )
 from surreal.agent import DDPGAgent
 from surreal.learner import DDPGLearner
-from surreal.replay import UniformReplay
+from surreal.replay import UniformReplay, TrajectoryReplay
 from surreal.launch import SurrealDefaultLauncher
 from surreal.env import make_env_config
 
@@ -267,6 +267,9 @@ class DDPGLauncher(SurrealDefaultLauncher):
                             help='Prevents sharding replay and paramter '
                             'server. Helps prevent address collision'
                             ' in unit testing.')
+        parser.add_argument('--trajectory-replay', action='store_true',
+                            help='agents send each step once and the replay '
+                            'builds the n-step experiences')
 
         args = parser.parse_args(args=argv)
 
@@ -283,6 +286,12 @@ class DDPGLauncher(SurrealDefaultLauncher):
         self.agent_batch_size = args.agent_batch
         self.eval_batch_size = args.eval_batch
 
+        if args.trajectory_replay:
+            self.replay_class = TrajectoryReplay
+            self.learner_config.replay.trajectory.enabled = True
+            self.learner_config.replay.trajectory.window_format = 'ssar'
+            self.learner_config.replay.trajectory.sampling = 'uniform'
+
         # Used in tests: Prevent IP address in use error
         #                Prevent replay from hanging learner
         #                due to sample_start
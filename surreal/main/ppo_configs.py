@@ -6,7 +6,7 @@ from surreal.session import (
     )
 from surreal.agent import PPOAgent
 from surreal.learner import PPOLearner
-from surreal.replay import FIFOReplay
+from surreal.replay import FIFOReplay, TrajectoryReplay
 from surreal.launch import SurrealDefaultLauncher
 from surreal.env import make_env, make_env_config
 import argparse
@@ -207,6 +207,9 @@ class PPOLauncher(SurrealDefaultLauncher):
                             help='how many agents/evals per batch')
         parser.add_argument('--unit-test', action='store_true',
                             help='Set config values to settings that can run locally for unit testing')
+        parser.add_argument('--trajectory-replay', action='store_true',
+                            help='agents send each step once and the replay '
+                            'builds the n-step windows')
 
         args = parser.parse_args(args=argv)
 
@@ -222,6 +225,12 @@ class PPOLauncher(SurrealDefaultLauncher):
         self.agent_batch_size = args.agent_batch
         self.eval_batch_size = args.agent_batch
 
+        if args.trajectory_replay:
+            self.replay_class = TrajectoryReplay
+            self.learner_config.replay.trajectory.enabled = True
+            self.learner_config.replay.trajectory.window_format = 'multistep'
+            self.learner_config.replay.trajectory.sampling = 'fifo'
+
         if args.unit_test:
             self.learner_config.replay.batch_size = 2
             self.learner_config.replay.sampling_start_size = 2
@@ -2,4 +2,6 @@ from .base import *
 from .dummy_replay import *
 from .uniform_replay import UniformReplay
 from .fifo_replay import FIFOReplay
+from .prioritized_replay import PrioritizedReplay
+from .trajectory_replay import TrajectoryReplay
 from .sharded_replay import ShardedReplay, ReplayLoadBalancer
\ No newline at end of file
@@ -1,9 +1,28 @@
 import time
 import os
+import atexit
+import queue
+import signal
+import sys
+import threading
+from collections import deque
+import numpy as np
+import psutil
 import surreal.utils as U
-from surreal.session import get_tensorplex_client, get_loggerplex_client
-from surreal.distributed import ExperienceCollectorServer
-from caraml.zmq import ZmqServer
+from surreal.session import (
+    get_tensorplex_client,
+    get_loggerplex_client,
+    ConfigError,
+)
+from surreal.distributed import ExperienceCollectorServer, ShmRingWriter
+from surreal.learner.aggregator import SSARAggregator, MultistepAggregatorWithInfo
+from .storage import write_snapshot_state
+from caraml.zmq import ZmqServer, ZmqClient
+
+
+def _exit_on_sigterm(signum, frame):
+    # SystemExit runs the atexit handlers
+    sys.exit(128 + signum)
 
 
 class Replay:
@@ -27,27 +46,79 @@ class Replay:
         self.env_config = env_config
         self.session_config = session_config
         self.index = index
+        # insert, sample and priority updates run in different threads
+        # insert notifies samplers waiting for start_sample_condition
+        self._memory_lock = threading.Condition()
 
         collector_port = os.environ['SYMPH_COLLECTOR_BACKEND_PORT']
         sampler_port = os.environ['SYMPH_SAMPLER_BACKEND_PORT']
         self._collector_server = ExperienceCollectorServer(
             host='localhost',
             port=collector_port,
-            exp_handler=self._insert_wrapper,
+            exp_list_handler=self._insert_batch_wrapper,
             load_balanced=True,
         )
-        self._sampler_server = ZmqServer(
-            host='localhost',
-            port=sampler_port,
-            bind=False)
-        self._sampler_server_thread = None
-
+        # each worker has its own socket and thread, they sample
+        # under the memory lock and serialize concurrently
+        self._sampler_port = sampler_port
+        self._sampler_workers = self.session_config.replay.sampler_workers
+        self._weighted_sampling = self.learner_config.replay.weighted_sampling
+        if self._weighted_sampling:
+            # sockets are created by _coordinated_sampler_loop
+            self._sampler_servers = []
+        else:
+            self._sampler_servers = [
+                ZmqServer(host='localhost', port=sampler_port, bind=False)
+                for _ in range(self._sampler_workers)
+            ]
+        self._sampler_server_threads = []
+
+        self._sample_ready_timeout = \
+            self.session_config.replay.sample_ready_timeout
         self._evict_interval = self.session_config.replay.evict_interval
         self._evict_thread = None
 
+        self._snapshot_interval = \
+            self.session_config.checkpoint.replay.snapshot_interval
+        self._snapshot_thread = None
+
+        # pre-sampled, serialized batches of learner_config.replay.batch_size
+        self._sample_ahead = self.session_config.replay.sample_ahead
+        if self._sample_ahead and self._weighted_sampling:
+            # _coordinated_sampler_loop samples partial batches itself,
+            # the pre-sampled ones would never be served
+            raise ConfigError('session_config.replay.sample_ahead is not '
+                              'supported with weighted_sampling')
+        self._sample_ahead_batch_size = self.learner_config.replay.batch_size
+        self._sample_ahead_queue = queue.Queue(maxsize=max(self._sample_ahead, 1))
+        # cached batches sampled before the last invalidation are dropped
+        self._sample_ahead_generation = 0
+        self._sample_ahead_thread = None
+
+        self._aggregator = self._create_aggregator()
+
+        # co-located learner: replies are written to shared memory,
+        # only their descriptors are sent
+        self._shm_ring = None
+        shm_ring_bytes = self.session_config.replay.shm_ring_bytes
+        if shm_ring_bytes:
+            if self._weighted_sampling:
+                raise ConfigError('session_config.replay.shm_ring_bytes is not '
+                                  'supported with weighted_sampling')
+            self._shm_ring = ShmRingWriter(
+                'surreal-replay-{}'.format(self.index), shm_ring_bytes)
+            atexit.register(self._shm_ring.close)
+            # atexit handlers do not run when the process is terminated
+            if (threading.current_thread() is threading.main_thread()
+                    and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL):
+                signal.signal(signal.SIGTERM, _exit_on_sigterm)
+
         self._setup_logging()
 
     def start_threads(self):
+        if self.session_config.checkpoint.restore:
+            self.restore_snapshot_from_checkpoint()
+
         if self._has_tensorplex:
             self.start_tensorplex_thread()
 
@@ -56,16 +127,32 @@ class Replay:
         if self._evict_interval:
             self.start_evict_thread()
 
-        self._sampler_server_thread = self._sampler_server.start_loop(
-            handler=self._sample_request_handler)
+        if self._snapshot_interval:
+            self.start_snapshot_thread()
+
+        if self._sample_ahead:
+            self.start_sample_ahead_thread()
+
+        for sampler_server in self._sampler_servers:
+            self._sampler_server_threads.append(sampler_server.start_loop(
+                handler=self._sample_request_handler))
+        if self._weighted_sampling:
+            for _ in range(self._sampler_workers):
+                self._sampler_server_threads.append(
+                    U.start_thread(self._coordinated_sampler_loop))
 
     def join(self):
         self._collector_server.join()
-        self._sampler_server_thread.join()
+        for thread in self._sampler_server_threads:
+            thread.join()
         if self._has_tensorplex:
             self._tensorplex_thread.join()
         if self._evict_interval:
             self._evict_thread.join()
+        if self._snapshot_interval:
+            self._snapshot_thread.join()
+        if self._sample_ahead:
+            self._sample_ahead_thread.join()
 
     def insert(self, exp_dict):
         """
@@ -77,6 +164,17 @@ class Replay:
         """
         raise NotImplementedError
 
+    def insert_batch(self, exp_list):
+        """
+        Add all experiences received in one message from the agents.
+        Override to insert them at once instead of one by one.
+
+        Args:
+            exp_list: list of exp_dict, see insert()
+        """
+        for exp_dict in exp_list:
+            self.insert(exp_dict)
+
     def sample(self, batch_size):
         """
         This function is called in _sample_handler for learner side Zmq request
@@ -85,16 +183,54 @@ class Replay:
             batch_size:
 
         Returns:
-            a list of exp_tuples
+            a list of exp_tuples, or an already aggregated batch
+            if the replay stores experiences in columns
         """
         raise NotImplementedError
 
     def evict(self):
         """
         Actively evict old experiences.
+        Called every session_config.replay.evict_interval seconds
+        with the memory lock held
+
+        Returns:
+            number of bytes evicted
+        """
+        return 0
+
+    def wait_for_room(self, count):
+        """
+        Called with the memory lock held before insert_batch(), may
+        release it with self._memory_lock.wait_for() until count
+        experiences can be inserted. Time spent here is reported as
+        backpressure_time_s rather than insert_time_s
+
+        Args:
+            count: number of experiences about to be inserted
         """
         pass
 
+    def snapshot_state(self):
+        """
+        Copy the content of the replay, called with the memory lock held.
+        The copy is written to disk after the lock is released
+
+        Returns:
+            {file name: np.array or json serializable value},
+            see write_snapshot_state
+        """
+        raise NotImplementedError
+
+    def restore_snapshot(self, folder):
+        """
+        Reload the content of the replay written by snapshot_state()
+
+        Args:
+            folder: the directory the snapshot was written into
+        """
+        raise NotImplementedError
+
     def start_sample_condition(self):
         """
         Tells the thread to start sampling only when this condition is met.
@@ -105,10 +241,92 @@ class Replay:
         """
         raise NotImplementedError
 
+    def aggregate(self, exps):
+        """
+        Turns what sample() returned into the batch sent to the learner.
+        Called outside of the memory lock.
+
+        Args:
+            exps: list of exp_dict, or a batch that is already aggregated
+
+        Returns:
+            dict of numpy arrays if learner_config.replay.aggregator is set
+        """
+        if self._aggregator is None or not isinstance(exps, list):
+            return exps
+        return self._aggregator.aggregate(exps)
+
+    def invalidate_sample_ahead(self):
+        """
+        Drops the batches pre-sampled by the sample ahead thread.
+        Call when they no longer match the replay content,
+        e.g. PrioritizedReplay after priority updates
+        """
+        self._sample_ahead_generation += 1
+
+    def sampling_weight(self):
+        """
+        With learner_config.replay.weighted_sampling, each learner batch
+        is split across shards in proportion to this value.
+        Called with the memory lock held
+
+        Returns:
+            float, by default the number of stored experiences
+        """
+        return float(len(self))
+
+    def record_staleness(self, staleness):
+        """
+        Called by sample() with how many learner iterations each sampled
+        experience lags behind the newest param_version received.
+        Percentiles are reported to tensorplex
+
+        Args:
+            staleness: array or list of ints
+        """
+        self._sampled_staleness.extend(np.asarray(staleness).tolist())
+
+    def storage_metrics(self):
+        """
+        Returns:
+            dict of storage specific values added to the core metrics
+        """
+        return {}
+
+    def memory_nbytes(self):
+        """
+        Returns:
+            bytes held by the stored experiences, reported to tensorplex
+        """
+        return 0
+
     def __len__(self):
         raise NotImplementedError
 
     # ======================== internal methods ========================
+    def _create_aggregator(self):
+        """
+            learner_config.replay.aggregator:
+            None: the learner aggregates the experiences
+            'ssar': SSARAggregator
+            'multistep_with_info': MultistepAggregatorWithInfo
+        """
+        aggregator = self.learner_config.replay.aggregator
+        if aggregator is None:
+            return None
+        obs_spec = self.env_config.obs_spec
+        action_spec = self.env_config.action_spec
+        if aggregator == 'ssar':
+            if not self.env_config.frame_stack_concatenate_on_env:
+                # FrameStackPreprocessor would modify the stored experiences
+                raise ConfigError('Replay side aggregation requires '
+                                  'env_config.frame_stack_concatenate_on_env')
+            return SSARAggregator(obs_spec, action_spec)
+        elif aggregator == 'multistep_with_info':
+            return MultistepAggregatorWithInfo(obs_spec, action_spec)
+        else:
+            raise ConfigError('Unknown replay aggregator: {}'.format(aggregator))
+
     def _setup_logging(self):
         self.log = get_loggerplex_client(
             '{}/{}'.format('replay', self.index),
@@ -125,50 +343,175 @@ class Replay:
         self.init_time = time.time()
         # Number of experience collected by agents
         self.cumulative_collected_count = 0
+        # Number of messages (i.e. insert_batch calls) received from agents
+        self.cumulative_insert_batch_count = 0
         # Number of experience sampled by learner
         self.cumulative_sampled_count = 0
         # Number of sampling requests from the learner
         self.cumulative_request_count = 0
+        # Number of sampling requests that timed out before sampling could start
+        self.cumulative_not_ready_count = 0
+        # Number of pre-sampled batches dropped by invalidate_sample_ahead()
+        self.cumulative_stale_batch_count = 0
+        # param_version lag of the last sampled experiences
+        self._sampled_staleness = deque(maxlen=10000)
+        # Number of experiences and bytes actively evicted
+        self.cumulative_evicted_count = 0
+        self.cumulative_evicted_bytes = 0
         # Timer for tensorplex reporting
         self.last_tensorplex_iter_time = time.time()
         # Last reported values used for speed computation
         self.last_experience_count = 0
+        self.last_insert_batch_count = 0
         self.last_sample_count = 0
         self.last_request_count = 0
 
         self.insert_time = U.TimeRecorder(decay=0.99998)
+        self.backpressure_time = U.TimeRecorder(decay=0.99998)
         self.sample_time = U.TimeRecorder()
         self.serialize_time = U.TimeRecorder()
+        self.aggregate_time = U.TimeRecorder()
+        self.shm_write_time = U.TimeRecorder()
+        self.snapshot_time = U.TimeRecorder()
+        # part of snapshot_time holding the memory lock
+        self.snapshot_copy_time = U.TimeRecorder()
 
         # moving avrage of about 100s
         self.exp_in_speed = U.MovingAverageRecorder(decay=0.99)
+        self.insert_batch_speed = U.MovingAverageRecorder(decay=0.99)
         self.exp_out_speed = U.MovingAverageRecorder(decay=0.99)
         self.handle_sample_request_speed = U.MovingAverageRecorder(decay=0.99)
 
-    def _insert_wrapper(self, exp):
+    def _insert_batch_wrapper(self, exp_list):
         """
             Allows us to do some book keeping in the base class
         """
-        self.cumulative_collected_count += 1
-        with self.insert_time.time():
-            self.insert(exp)
+        self.cumulative_collected_count += len(exp_list)
+        self.cumulative_insert_batch_count += 1
+        with self._memory_lock:
+            with self.backpressure_time.time():
+                self.wait_for_room(len(exp_list))
+            with self.insert_time.time():
+                self.insert_batch(exp_list)
+            self._memory_lock.notify_all()
 
     def _sample_request_handler(self, req):
         """
         Handle requests to the learner
-        https://stackoverflow.com/questions/29082268/python-time-sleep-vs-event-wait
-        Since we don't have external notify, we'd better just use sleep
+        Replies None if the replay is not ready to sample,
+        the learner then simply requests again.
+        Runs in session_config.replay.sampler_workers threads
         """
         batch_size = U.deserialize(req)
         U.assert_type(batch_size, int)
-        while not self.start_sample_condition():
-            time.sleep(0.01)
-        self.cumulative_sampled_count += batch_size
-        self.cumulative_request_count += 1
-        with self.sample_time.time():
-            sample = self.sample(batch_size)
-        with self.serialize_time.time():
-            return U.serialize(sample)
+        if self._sample_ahead and batch_size == self._sample_ahead_batch_size:
+            data = self._get_sampled_ahead()
+        else:
+            sample = self._sample_batch(batch_size)
+            with self.serialize_time.time():
+                data = U.serialize(sample)
+        if self._shm_ring is not None:
+            with self.shm_write_time.time():
+                data = U.serialize(self._shm_ring.write(data))
+        return data
+
+    def start_sample_ahead_thread(self):
+        if self._sample_ahead_thread is not None:
+            raise RuntimeError('sample ahead thread already running')
+        self._sample_ahead_thread = U.start_thread(self._sample_ahead_loop)
+        return self._sample_ahead_thread
+
+    def _sample_ahead_loop(self):
+        """
+        Keeps session_config.replay.sample_ahead serialized batches ready
+        """
+        while True:
+            # read before sampling, an invalidation in between
+            # can only drop a batch that was still valid
+            generation = self._sample_ahead_generation
+            sample = self._sample_batch(self._sample_ahead_batch_size)
+            if sample is None:
+                continue
+            with self.serialize_time.time():
+                data = U.serialize(sample)
+            self._sample_ahead_queue.put((generation, data), block=True)
+
+    def _get_sampled_ahead(self):
+        """
+        Returns the oldest valid pre-sampled batch, serialized None if
+        there is none within session_config.replay.sample_ready_timeout
+        """
+        while True:
+            try:
+                generation, data = self._sample_ahead_queue.get(
+                    block=True, timeout=self._sample_ready_timeout)
+            except queue.Empty:
+                return U.serialize(None)
+            if generation == self._sample_ahead_generation:
+                return data
+            self.cumulative_stale_batch_count += 1
+
+    def _sample_batch(self, batch_size):
+        """
+        Waits until start_sample_condition() is met, woken up by inserts,
+        then samples and aggregates the batch. Only sampling holds
+        the memory lock.
+
+        Returns:
+            None if start_sample_condition() is not met within
+            session_config.replay.sample_ready_timeout seconds
+        """
+        with self._memory_lock:
+            ready = self._memory_lock.wait_for(
+                self.start_sample_condition,
+                timeout=self._sample_ready_timeout)
+            if not ready:
+                self.cumulative_not_ready_count += 1
+                return None
+            with self.sample_time.time():
+                sample = self.sample(batch_size)
+            self.cumulative_sampled_count += batch_size
+            self.cumulative_request_count += 1
+        with self.aggregate_time.time():
+            if isinstance(sample, dict) and 'replay_info' in sample:
+                sample['exps'] = self.aggregate(sample['exps'])
+            else:
+                sample = self.aggregate(sample)
+        return sample
+
+    def _coordinated_sampler_loop(self):
+        """
+        Replaces the sampler servers with learner_config.replay.weighted_sampling
+        Asks ShardSamplingCoordinator for tasks
+            {'request_id', 'batch_size', 'wait'}
+        and replies with the partial batch and this shard's sampling weight
+        in the next request. batch_size 0 only asks for the weight,
+        'wait' to report it once the replay is ready to sample.
+        """
+        client = ZmqClient(host='localhost', port=self._sampler_port)
+        request_id, sample = None, None
+        while True:
+            with self._memory_lock:
+                if self.start_sample_condition():
+                    weight = self.sampling_weight()
+                else:
+                    weight = 0.
+            with self.serialize_time.time():
+                msg = U.serialize({
+                    'shard': self.index,
+                    'weight': weight,
+                    'request_id': request_id,
+                    'sample': sample,
+                })
+            task = U.deserialize(client.request(msg))
+            request_id, sample = task['request_id'], None
+            if task['batch_size'] > 0:
+                sample = self._sample_batch(task['batch_size'])
+            elif task['wait']:
+                with self._memory_lock:
+                    self._memory_lock.wait_for(
+                        self.start_sample_condition,
+                        timeout=self._sample_ready_timeout)
 
     def start_evict_thread(self):
         if self._evict_thread is not None:
@@ -180,7 +523,77 @@ class Replay:
         assert self._evict_interval
         while True:
             time.sleep(self._evict_interval)
-            self.evict()
+            with self._memory_lock:
+                count_before = len(self)
+                evicted_bytes = self.evict()
+                self.cumulative_evicted_count += count_before - len(self)
+            self.cumulative_evicted_bytes += evicted_bytes
+
+    def start_snapshot_thread(self):
+        if self._snapshot_thread is not None:
+            raise RuntimeError('snapshot thread already running')
+        self._snapshot_thread = U.start_thread(self._snapshot_loop)
+        return self._snapshot_thread
+
+    def _snapshot_loop(self):
+        assert self._snapshot_interval
+        while True:
+            time.sleep(self._snapshot_interval)
+            self.save_snapshot()
+
+    def _snapshot_folder(self, checkpoint_folder):
+        return U.f_join(checkpoint_folder, 'replay-{}'.format(self.index))
+
+    def save_snapshot(self):
+        """
+            Snapshots the replay into <session folder>/checkpoint/replay-<index>
+            The previous snapshot is only replaced once the new one
+            is completely written
+            The memory lock is only held while the replay content
+            is copied, which takes as much memory again
+        """
+        folder = self._snapshot_folder(
+            U.f_join(self.session_config.folder, 'checkpoint'))
+        tmp_folder = folder + '.tmp'
+        old_folder = folder + '.old'
+        U.f_remove(tmp_folder)
+        U.f_mkdir(tmp_folder)
+        with self.snapshot_time.time():
+            with self.snapshot_copy_time.time(), self._memory_lock:
+                state = self.snapshot_state()
+            write_snapshot_state(state, tmp_folder)
+            del state
+        U.f_remove(old_folder)
+        if U.f_exists(folder):
+            os.rename(folder, old_folder)
+        os.rename(tmp_folder, folder)
+        U.f_remove(old_folder)
+        self.log.info('Snapshot of {} experiences saved to {} in {:.1f}s'
+                      .format(len(self), folder, self.snapshot_time.avg))
+
+    def restore_snapshot_from_checkpoint(self):
+        """
+            Follows session_config.checkpoint.restore_folder
+            like Learner.restore_checkpoint
+        """
+        SC = self.session_config
+        restore_folder = SC.checkpoint.restore_folder
+        if restore_folder is None:
+            restore_folder = U.f_join(SC.folder, 'checkpoint')
+        elif U.f_last_part_in_path(restore_folder) != 'checkpoint':
+            # automatically append 'checkpoint' subfolder
+            restore_folder = U.f_join(restore_folder, 'checkpoint')
+        folder = self._snapshot_folder(restore_folder)
+        if not U.f_exists(folder) and U.f_exists(folder + '.old'):
+            # preempted while replacing the previous snapshot
+            folder = folder + '.old'
+        if not U.f_exists(folder):
+            self.log.info('No replay snapshot found in {}'.format(folder))
+            return
+        with self._memory_lock:
+            self.restore_snapshot(folder)
+        self.log.info('Restored {} experiences from {}'
+                      .format(len(self), folder))
 
     def start_tensorplex_thread(self):
         if self._tensorplex_thread is not None:
@@ -202,6 +615,10 @@ class Replay:
         new_exp_count = cum_count_collected - self.last_experience_count
         self.last_experience_count = cum_count_collected
 
+        cum_count_insert_batches = self.cumulative_insert_batch_count
+        new_insert_batch_count = cum_count_insert_batches - self.last_insert_batch_count
+        self.last_insert_batch_count = cum_count_insert_batches
+
         cum_count_sampled = self.cumulative_sampled_count
         new_sample_count = cum_count_sampled - self.last_sample_count
         self.last_sample_count = cum_count_sampled
@@ -211,6 +628,8 @@ class Replay:
         self.last_request_count = cum_count_requests
 
         exp_in_speed = self.exp_in_speed.add_value(new_exp_count / time_elapsed)
+        insert_batch_speed = self.insert_batch_speed.add_value(
+                                                    new_insert_batch_count / time_elapsed)
         exp_out_speed = self.exp_out_speed.add_value(new_sample_count / time_elapsed)
         handle_sample_request_speed = self.handle_sample_request_speed.add_value(
                                                     new_request_count / time_elapsed)
@@ -219,21 +638,49 @@ class Replay:
         sample_time = self.sample_time.avg
         serialize_time = self.serialize_time.avg
 
+        num_exps = len(self)
+        memory_nbytes = self.memory_nbytes()
+
         core_metrics = {
-            'num_exps': len(self),
+            'num_exps': num_exps,
+            'memory_bytes': memory_nbytes,
+            'bytes_per_exp': memory_nbytes / num_exps if num_exps else 0,
             'total_collected_exps': cum_count_collected,
             'total_sampled_exps': cum_count_sampled,
             'total_sample_requests': self.cumulative_request_count,
+            'total_not_ready_replies': self.cumulative_not_ready_count,
+            'total_stale_sampled_ahead_batches': self.cumulative_stale_batch_count,
+            'sampled_ahead_batches': self._sample_ahead_queue.qsize(),
+            'total_evicted_exps': self.cumulative_evicted_count,
+            'total_evicted_bytes': self.cumulative_evicted_bytes,
             'exp_in_per_s': exp_in_speed,
+            'insert_batches_per_s': insert_batch_speed,
             'exp_out_per_s': exp_out_speed,
             'requests_per_s': handle_sample_request_speed,
+            # per insert_batch call
             'insert_time_s': insert_time,
+            'backpressure_time_s': self.backpressure_time.avg,
             'sample_time_s': sample_time,
             'serialize_time_s': serialize_time,
+            'aggregate_time_s': self.aggregate_time.avg,
+            'shm_write_time_s': self.shm_write_time.avg,
+            'snapshot_time_s': self.snapshot_time.avg,
+            'snapshot_copy_time_s': self.snapshot_copy_time.avg,
         }
+        core_metrics.update(self.storage_metrics())
+        with self._memory_lock:
+            staleness = np.array(self._sampled_staleness)
+        if len(staleness):
+            p50, p90, p99 = np.percentile(staleness, [50, 90, 99])
+            core_metrics.update({
+                'sampled_staleness_p50': p50,
+                'sampled_staleness_p90': p90,
+                'sampled_staleness_p99': p99,
+                'sampled_staleness_max': staleness.max(),
+            })
 
         serialize_load = serialize_time * handle_sample_request_speed / time_elapsed
-        collect_exp_load = insert_time * exp_in_speed / time_elapsed
+        collect_exp_load = insert_time * insert_batch_speed / time_elapsed
         sample_exp_load = sample_time * handle_sample_request_speed / time_elapsed
 
         system_metrics = {
@@ -243,6 +690,7 @@ class Replay:
             'serialization_load_percent': serialize_load * 100,
             'collect_exp_load_percent': collect_exp_load * 100,
             'sample_exp_load_percent': sample_exp_load * 100,
+            'rss_bytes': psutil.Process().memory_info().rss,
             # 'exp_queue_occupancy_percent': self._exp_queue.occupancy() * 100,
         }
 
@@ -1,6 +1,6 @@
-import random
-from collections import deque
 from .base import Replay
+from .storage import FIFOStorage
+from surreal.session import ConfigError
 
 
 class FIFOReplay(Replay):
@@ -10,6 +10,16 @@ class FIFOReplay(Replay):
     - max_prefetch_queue: to 1
     session_config.sender:
     - flush_iteration: to a small number
+
+    With learner_config.replay.sampler.max_staleness, experiences more
+    than max_staleness learner iterations behind the newest param_version
+    are not queued, and queued ones are dropped as soon as a newer
+    version arrives.
+
+    Experiences are never dropped when the queue is full: the collector
+    waits for the learner to sample, which stops it from receiving and
+    in turn blocks the agents' senders. Samplers are woken up as soon as
+    batch_size experiences are queued.
     """
     def __init__(self,
                  learner_config,
@@ -24,7 +34,13 @@ class FIFOReplay(Replay):
         )
         self.batch_size = self.learner_config.replay.batch_size
         self.memory_size = self.learner_config.replay.memory_size
-        self._memory = deque(maxlen=self.memory_size+3)  # + 3 for a gentle buffering
+        self._memory = FIFOStorage(self.memory_size + 3)  # + 3 for a gentle buffering
+        self._max_staleness = self.learner_config.replay.sampler.max_staleness
+        self._newest_version = 0
+        if self.session_config.replay.evict_interval:
+            raise ConfigError('FIFOReplay does not support eviction, unset '
+                              'session_config.replay.evict_interval, '
+                              'see learner_config.replay.sampler.max_staleness')
         assert self.session_config.replay.max_puller_queue <= 10
         assert self.session_config.replay.max_prefetch_queue == 1 
         assert not self.session_config.sender.flush_time
@@ -32,14 +48,49 @@ class FIFOReplay(Replay):
 
 
     def insert(self, exp_tuple):
-        self._memory.append(exp_tuple)
+        self.insert_batch([exp_tuple])
+
+    def wait_for_room(self, count):
+        count = min(count, self.memory_size)
+        self._memory_lock.wait_for(lambda: self._memory.free() >= count)
+
+    def insert_batch(self, exp_list):
+        """
+        Called with the memory lock held. wait_for_room() already made
+        room for exp_list unless insert_batch is called directly, it
+        then releases the lock while waiting for room in the queue
+        """
+        newest = max(exp.get('param_version', 0) for exp in exp_list)
+        if newest > self._newest_version:
+            self._newest_version = newest
+            if self._max_staleness is not None:
+                self._drop_stale()
+        if self._max_staleness is not None:
+            # lagging agents keep sending stale experiences
+            fresh = [exp for exp in exp_list if self._is_fresh(exp)]
+            self.cumulative_evicted_count += len(exp_list) - len(fresh)
+            exp_list = fresh
+        while len(exp_list) > 0:
+            self._memory_lock.wait_for(lambda: self._memory.free() > 0)
+            pushed = self._memory.push_batch(exp_list)
+            exp_list = exp_list[pushed:]
+            self._memory_lock.notify_all()
+
+    def _is_fresh(self, exp):
+        return (exp.get('param_version', 0)
+                >= self._newest_version - self._max_staleness)
+
+    def _drop_stale(self):
+        self.cumulative_evicted_count += self._memory.retain(self._is_fresh)
 
     def sample(self, batch_size):
         assert batch_size <= self.memory_size
-        return [self._memory.popleft() for _ in range(batch_size)]
-
-    def evict(self):
-        raise NotImplementedError('no support for eviction in FIFO mode')
+        exps = self._memory.pop_n(batch_size)
+        # room for a collector waiting in insert_batch
+        self._memory_lock.notify_all()
+        self.record_staleness([self._newest_version - exp.get('param_version', 0)
+                               for exp in exps])
+        return exps
 
     def start_sample_condition(self):
         return len(self._memory) >= self.batch_size
@@ -1,170 +1,229 @@
 # Adapted from https://github.com/openai/baselines
 
+import os
 import numpy as np
-import random
+from caraml.zmq import ZmqSub
+import surreal.utils as U
+from surreal.session import ConfigError
+from surreal.distributed.priority_update import priority_update_topic
+from .uniform_replay import UniformReplay
+from .segment_tree import NumpySumSegmentTree, NumpyMinSegmentTree
+
+
+class PrioritizedReplay(UniformReplay):
+    """
+        Samples experiences proportionally to their priority.
+        Each sample is sent as
+        {
+            'exps': whatever UniformReplay would send,
+            'replay_info': {
+                'shard': replay index of each experience,
+                'indices': index of each experience in the shard,
+                'weights': importance sampling weights,
+                'generation': compaction generation of the shard,
+            }
+        }
+        The learner sends new priorities back through
+        PriorityUpdatePublisher, see Learner.update_replay_priorities.
+        Removing experiences compacts the storage and moves the ones
+        after them, updates for batches sampled before are dropped.
+    """
+    EVICT_POLICIES = UniformReplay.EVICT_POLICIES + ('lowest_priority',)
 
-from segment_tree import SumSegmentTree, MinSegmentTree
-
-
-class PrioritizedReplay(Replay):
-    
     def __init__(self,
                  learner_config,
                  env_config,
-                 session_config):
+                 session_config,
+                 index=0):
         """
-        Create Prioritized Replay buffer.
-        :param size: int
-            Max number of transitions to store in the buffer. When the buffer
-            overflows the old memories are dropped.
-        :param alpha: float
-            how much prioritization is used
-            (0 - no prioritization, 1 - full prioritization)
+        Args:
+          learner_config.replay.prioritized:
+            alpha: how much prioritization is used
+              (0 - no prioritization, 1 - full prioritization)
+            beta: to what degree to use importance weights
+              (0 - no corrections, 1 - full correction)
         """
-        super(PrioritizedReplayBuffer, self).__init__(
+        super().__init__(
             learner_config=learner_config,
             env_config=env_config,
-            session_config=session_config
+            session_config=session_config,
+            index=index
         )
-
-        self._alpha = self.replay_config.alpha
+        self._alpha = self.learner_config.replay.prioritized.alpha
+        self._beta = self.learner_config.replay.prioritized.beta
         assert self._alpha > 0
+        assert self._beta >= 0
+        if self._max_staleness is not None:
+            raise ConfigError('PrioritizedReplay does not support '
+                              'learner_config.replay.sampler.max_staleness, '
+                              'use evict.policy "stale"')
 
-        self._memory = []
-        self.memory_size = self.replay_config.memory_size
         it_capacity = 1
         while it_capacity < self.memory_size:
             it_capacity *= 2
 
-        self._it_sum = SumSegmentTree(it_capacity)
-        self._it_min = MinSegmentTree(it_capacity)
+        self._it_sum = NumpySumSegmentTree(it_capacity)
+        self._it_min = NumpyMinSegmentTree(it_capacity)
         self._max_priority = 1.0
+        # bumped whenever stored experiences move to other indices
+        self._compaction_generation = 0
+        # priority updates that no longer match an experience
+        self.cumulative_dropped_priority_count = 0
+
+        self._priority_sub = ZmqSub(
+            host=os.environ['SYMPH_PRIORITY_UPDATE_HOST'],
+            port=os.environ['SYMPH_PRIORITY_UPDATE_PORT'],
+            topic=priority_update_topic(self.index),
+            deserializer=U.deserialize,
+        )
+        self._priority_sub_thread = None
+
+    def start_threads(self):
+        self._priority_sub_thread = self._priority_sub.start_loop(
+            handler=self._priority_update_handler)
+        super().start_threads()
 
-    def default_config(self):
-        conf = super().default_config()
-        conf.update({
-            'memory_size': '_int_',
-            'sampling_start_size': '_int_',
-            'alpha': '_float_',
-        })
-        return conf
+    def join(self):
+        super().join()
+        self._priority_sub_thread.join()
 
     def insert(self, exp_dict):
         """
         Adds experience to the replay buffer as usual, but also
-        intiialize the priority of the new experience.
+        initializes the priority of the new experience.
         """
-        with self.insert_time.time():
-            if self._next_idx >= len(self._memory):
-                self._memory.append(exp_dict)
-            else:
-                self._memory[self._next_idx] = exp_dict
-            self._next_idx = (self._next_idx + 1) % self.memory_size
-
-            idx = self._next_idx
-            self._it_sum[idx] = self._max_priority ** self._alpha
-            self._it_min[idx] = self._max_priority ** self._alpha
-
-    def sample(self, batch_size, beta=0):
+        self.insert_batch([exp_dict])
+
+    def insert_batch(self, exp_list):
+        self._make_room(exp_list)
+        indices = self._sampler.insert_batch(self._memory, exp_list)
+        self._it_sum[indices] = self._max_priority ** self._alpha
+        self._it_min[indices] = self._max_priority ** self._alpha
+        self._enforce_memory_bytes()
+
+    def snapshot_state(self):
+        state = super().snapshot_state()
+        state['priorities.npy'] = self._it_sum[np.arange(len(self))]
+        return state
+
+    def restore_snapshot(self, folder):
+        super().restore_snapshot(folder)
+        # stored to the power of alpha, as in the trees
+        priorities = np.load(U.f_join(folder, 'priorities.npy'))
+        indices = np.arange(len(priorities))
+        self._it_sum[indices] = priorities
+        self._it_min[indices] = priorities
+        self._compaction_generation += 1
+        if len(priorities):
+            self._max_priority = priorities.max() ** (1 / self._alpha)
+
+    def sample(self, batch_size):
         """
-        WARNING: This function does not make deep copies of the tuple experiences.
-                 This means that if any objects in the experiences are modified,
-                 the contents of the replay buffer memory will also be modified,
-                 so be careful!!!
-        Sample a batch of experiences, along with their importance weights, and the 
+        WARNING: This function does not make deep copies of the experiences.
+        Sample a batch of experiences, along with their importance weights, and the
         indices of the sampled experiences in the buffer.
-        :param batch_size: int
-            How many transitions to sample.
-        :param beta: float
-            To what degree to use importance weights
-            (0 - no corrections, 1 - full correction)
-        :return experience_batch: List
-            List of tuples, length batch_size, corresponding to the experiences sampled.
-        :return weights: np.array
-            Array of shape (batch_size,) and dtype np.float32
-            denoting importance weight of each sampled transition
-        :return indices: np.array
-            Array of shape (batch_size,) and dtype np.int32
-            indices in buffer of sampled experiences
         """
-        with self.sample_time.time():
-            assert beta >= 0
-
-            # sample the experiences proportional to their priorities
-            indices = self._sample_proportional(batch_size)
-            response = [self._storage[idx] for idx in indices]
-
-            # compute importance weights for the experiences to correct for distribution shift
-            weights = []
-            p_min = self._it_min.min() / self._it_sum.sum()
-            max_weight = (p_min * len(self._storage)) ** (-beta)
-
-            for idx in indices:
-                p_sample = self._it_sum[idx] / self._it_sum.sum()
-                weight = (p_sample * len(self._storage)) ** (-beta)
-                weights.append(weight / max_weight)
-            weights = np.array(weights)
-
-        # return response, weights, indices
-        return response
+        indices = self._sample_proportional(batch_size)
+        exps = self._memory.get(indices)
+        self.record_staleness(self._memory.newest_version
+                              - self._memory.versions(indices))
+
+        # compute importance weights for the experiences to correct for distribution shift
+        total = self._it_sum.sum()
+        p_min = self._it_min.min() / total
+        max_weight = (p_min * len(self)) ** (-self._beta)
+        p_sample = self._it_sum[indices] / total
+        weights = (p_sample * len(self)) ** (-self._beta) / max_weight
+
+        return {
+            'exps': exps,
+            'replay_info': {
+                'shard': np.full(batch_size, self.index, dtype=np.int32),
+                'indices': indices,
+                'weights': weights.astype(np.float32),
+                'generation': np.full(batch_size, self._compaction_generation,
+                                      dtype=np.int64),
+            }
+        }
+
+    def sampling_weight(self):
+        """
+        Total priority, so that cross-shard sampling stays proportional
+        to priorities
+        """
+        return float(self._it_sum.sum())
 
     def _sample_proportional(self, batch_size):
         """
-        This is a helper function to sample expriences with probabilities 
+        This is a helper function to sample experiences with probabilities
         proportional to their priorities.
-        Returns a list of indices.
+        Returns an array of indices.
         """
-        res = []
-        for _ in range(batch_size):
-            mass = random.random() * self._it_sum.sum(0, len(self._storage) - 1)
-            idx = self._it_sum.find_prefixsum_idx(mass)
-            res.append(idx)
-        return res
-
-    def update_priorities(self, indices, priorities):
+        masses = np.random.random(batch_size) * self._it_sum.sum()
+        indices = self._it_sum.find_prefixsum_idx(masses)
+        # guards against float rounding landing on an empty leaf
+        return np.minimum(indices, len(self) - 1)
+
+    def update_priorities(self, indices, priorities, generations=None):
         """
         Update priorities of sampled transitions.
         sets priority of transition at index indices[i] in buffer
         to priorities[i].
-        :param indices: [int]
-            List of indices of sampled transitions
-        :param priorities: [float]
-            List of updated priorities corresponding to
-            transitions at the sampled indices denoted by
-            variable `indices`.
+        Updates sampled before the last compaction, or pointing past
+        the stored experiences, are dropped.
+
+        Args:
+            indices: indices of sampled transitions
+            priorities: updated priorities corresponding to
+                transitions at the sampled indices
+            generations: replay_info.generation of the sampled transitions,
+                None if they are known to be current
         """
+        indices = np.asarray(indices)
+        priorities = np.asarray(priorities, dtype=np.float64)
         assert len(indices) == len(priorities)
-        for idx, priority in zip(indices, priorities):
-            assert priority > 0
-            assert 0 <= idx < len(self._storage)
-            self._it_sum[idx] = priority ** self._alpha
-            self._it_min[idx] = priority ** self._alpha
-
-            self._max_priority = max(self._max_priority, priority)
-
-    def evict(self):
-        raise NotImplementedError # TODO
-        # if evict_size > len(self._memory):
-        #     evicted = self._memory
-        #     self._memory = []
-        #     self._next_idx = 0
-        #     return evicted
-        # forward_space = len(self._memory) - self._next_idx
-        # if evict_size < forward_space:
-        #     evicted = self._memory[self._next_idx:self._next_idx+evict_size]
-        #     del self._memory[self._next_idx:self._next_idx+evict_size]
-        # else:
-        #     evicted = self._memory[self._next_idx:]
-        #     evict_from_left = evict_size - forward_space
-        #     evicted += self._memory[:evict_from_left]
-        #     del self._memory[self._next_idx:]
-        #     del self._memory[:evict_from_left]
-        #     self._next_idx -= evict_from_left
-        # assert len(evicted) == evict_size
-        # return evicted
-
-    def start_sample_condition(self):
-        return len(self) > self.replay_config.sampling_start_size
-
-    def __len__(self):
-        return len(self._memory)
+        assert np.all(priorities > 0)
+        valid = (0 <= indices) & (indices < len(self))
+        if generations is not None:
+            valid &= np.asarray(generations) == self._compaction_generation
+        self.cumulative_dropped_priority_count += int(len(valid) - valid.sum())
+        indices, priorities = indices[valid], priorities[valid]
+        if len(indices) == 0:
+            return
+        self._it_sum[indices] = priorities ** self._alpha
+        self._it_min[indices] = priorities ** self._alpha
+        self._max_priority = max(self._max_priority, priorities.max())
+
+    def _eviction_order(self, policy):
+        if policy == 'lowest_priority':
+            priorities = self._it_sum[np.arange(len(self))]
+            return np.argsort(priorities, kind='mergesort')
+        return super()._eviction_order(policy)
+
+    def _remove(self, indices):
+        old_size = len(self)
+        old_indices = np.arange(old_size)
+        priorities = self._it_sum[old_indices]
+        keep = super()._remove(indices)
+        # sampled indices moved
+        self._compaction_generation += 1
+        self.invalidate_sample_ahead()
+        # move priorities along with the compacted experiences
+        n = len(keep)
+        self._it_sum[old_indices] = np.concatenate(
+            [priorities[keep], np.zeros(old_size - n)])
+        self._it_min[old_indices] = np.concatenate(
+            [priorities[keep], np.full(old_size - n, float('inf'))])
+        return keep
+
+    def storage_metrics(self):
+        metrics = super().storage_metrics()
+        metrics['total_dropped_priority_updates'] = \
+            self.cumulative_dropped_priority_count
+        return metrics
+
+    def _priority_update_handler(self, msg):
+        indices, priorities, generations = msg
+        with self._memory_lock:
+            self.update_priorities(indices, priorities, generations)
+            self.invalidate_sample_ahead()
@@ -0,0 +1,132 @@
+"""
+Index samplers: which stored experiences UniformReplay samples,
+and for reservoir sampling, which ones new experiences replace
+"""
+import numpy as np
+from surreal.session import ConfigError
+
+
+class IndexSampler(object):
+    def sample(self, memory, batch_size, candidates=None):
+        """
+        Args:
+            memory: RingStorage, not empty
+            candidates: if not None, non empty array of the indices
+                to sample from, from oldest to newest
+
+        Returns:
+            array of batch_size indices into memory
+        """
+        raise NotImplementedError
+
+    def insert_batch(self, memory, exp_list):
+        """
+        By default experiences overwrite the oldest ones
+
+        Returns:
+            array of indices where exp_list is stored
+        """
+        return memory.insert_batch(exp_list)
+
+    def state_dict(self):
+        """
+        Returns:
+            json serializable state saved with replay snapshots
+        """
+        return {}
+
+    def load_state_dict(self, state):
+        pass
+
+
+class UniformSampler(IndexSampler):
+    def sample(self, memory, batch_size, candidates=None):
+        if candidates is None:
+            return np.random.randint(len(memory), size=batch_size)
+        return candidates[np.random.randint(len(candidates), size=batch_size)]
+
+
+class RecencySampler(IndexSampler):
+    """
+        The probability to sample an experience decays exponentially with
+        its age, counted in experiences inserted after it.
+    """
+    def __init__(self, half_life):
+        """
+        Args:
+            half_life: age (in experiences) at which the probability
+                is half the one of the newest experience
+        """
+        self.half_life = half_life
+        self._decay = 0.5 ** (1. / half_life)
+
+    def sample(self, memory, batch_size, candidates=None):
+        size = len(memory) if candidates is None else len(candidates)
+        u = np.random.random(batch_size)
+        # inverse CDF of the geometric distribution truncated to [0, size)
+        ages = np.floor(np.log1p(-u * (1. - self._decay ** size))
+                        / np.log(self._decay)).astype(np.int64)
+        # guards against float rounding
+        ages = np.clip(ages, 0, size - 1)
+        if candidates is None:
+            return memory.indices_by_age(ages)
+        return candidates[size - 1 - ages]
+
+
+class ReservoirSampler(UniformSampler):
+    """
+        Samples uniformly, and once the memory is full keeps a uniform
+        sample of every experience received so far (algorithm R) instead
+        of the newest ones: the n-th experience replaces a random one
+        with probability capacity / n.
+        Slots no longer follow insertion order, 'oldest' eviction and
+        memory_bytes then evict arbitrary experiences.
+    """
+    def __init__(self):
+        # experiences received, including the ones not kept
+        self.seen = 0
+
+    def state_dict(self):
+        return {'seen': self.seen}
+
+    def load_state_dict(self, state):
+        self.seen = state['seen']
+
+    def insert_batch(self, memory, exp_list):
+        indices = []
+        free = max(memory.capacity - len(memory), 0)
+        if free > 0 and len(exp_list) > 0:
+            indices.append(memory.insert_batch(exp_list[:free]))
+        rest = exp_list[free:]
+        self.seen += len(exp_list) - len(rest)
+        if len(rest) > 0:
+            counts = self.seen + 1 + np.arange(len(rest))
+            kept = np.flatnonzero(
+                np.random.random(len(rest)) * counts < memory.capacity)
+            slots = np.random.randint(memory.capacity, size=len(kept))
+            # a slot drawn twice ends up with the latest experience
+            _, last = np.unique(slots[::-1], return_index=True)
+            last = np.sort(len(slots) - 1 - last)
+            if len(last) > 0:
+                indices.append(memory.insert_batch(
+                    [rest[i] for i in kept[last]], indices=slots[last]))
+            self.seen += len(rest)
+        if not indices:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(indices)
+
+
+def make_index_sampler(sampler_config):
+    """
+    Args:
+        sampler_config: learner_config.replay.sampler
+    """
+    if sampler_config.type == 'uniform':
+        return UniformSampler()
+    elif sampler_config.type == 'recency':
+        return RecencySampler(sampler_config.half_life)
+    elif sampler_config.type == 'reservoir':
+        return ReservoirSampler()
+    else:
+        raise ConfigError('Unknown replay sampler: {}'
+                          .format(sampler_config.type))
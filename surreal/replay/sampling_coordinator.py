@@ -0,0 +1,136 @@
+"""
+    Splits every learner sample request across all replay shards
+"""
+import threading
+from collections import deque
+import numpy as np
+import zmq
+import surreal.utils as U
+
+
+def merge_samples(samples):
+    """
+    Concatenates partial batches sampled by different shards
+
+    Args:
+        samples: list of replies of Replay._sample_batch, not None
+
+    Returns:
+        list of experiences, or a batch with the arrays concatenated
+    """
+    first = samples[0]
+    if isinstance(first, dict):
+        return {key: merge_samples([sample[key] for sample in samples])
+                for key in first}
+    if isinstance(first, list):
+        if len(first) > 0 and isinstance(first[0], dict):
+            # experiences
+            return [exp for sample in samples for exp in sample]
+        # e.g. persistent_infos of MultistepAggregatorWithInfo
+        return [merge_samples(list(values)) for values in zip(*samples)]
+    if first is None:
+        return None
+    return np.concatenate(samples)
+
+
+class ShardSamplingCoordinator(threading.Thread):
+    """
+        Takes the place of the sampler router-dealer proxy with
+        learner_config.replay.weighted_sampling. Each learner request
+        for batch_size experiences is split across the shards
+        following a multinomial draw weighted by their sampling_weight()
+        (number of experiences, total priority for PrioritizedReplay),
+        and the partial batches are merged into one reply.
+
+        The sampler workers of the shards connect REQ sockets, see
+        Replay._coordinated_sampler_loop. A learner request is dispatched
+        once every shard has an idle worker, every shard reports its weight
+        for the next split even when asked for 0 experiences.
+
+        Note that PrioritizedReplay normalizes importance weights
+        within each shard.
+    """
+    def __init__(self, frontend_add, backend_add, shards):
+        """
+        Args:
+            frontend_add: address the learner facing ROUTER binds to
+            backend_add: address the shard facing ROUTER binds to
+            shards: number of replay shards
+        """
+        super().__init__(daemon=True)
+        self.frontend_add = frontend_add
+        self.backend_add = backend_add
+        self.shards = shards
+        self._idle_workers = [deque() for _ in range(shards)]
+        # weights are unknown until the shards report them
+        self._weights = np.ones(shards)
+        self._learner_requests = deque()
+        self._pending = {}
+        self._next_request_id = 0
+
+    def run(self):
+        context = zmq.Context()
+        frontend = context.socket(zmq.ROUTER)
+        frontend.bind(self.frontend_add)
+        backend = context.socket(zmq.ROUTER)
+        backend.bind(self.backend_add)
+        poller = zmq.Poller()
+        poller.register(frontend, zmq.POLLIN)
+        poller.register(backend, zmq.POLLIN)
+        while True:
+            events = dict(poller.poll())
+            if backend in events:
+                self._handle_worker(frontend, backend.recv_multipart())
+            if frontend in events:
+                client, _, req = frontend.recv_multipart()
+                self._learner_requests.append((client, U.deserialize(req)))
+            self._dispatch(backend)
+
+    def _handle_worker(self, frontend, frames):
+        worker, _, msg = frames
+        msg = U.deserialize(msg)
+        shard = msg['shard']
+        self._weights[shard] = msg['weight']
+        self._idle_workers[shard].append(worker)
+        request_id = msg['request_id']
+        if request_id is None:
+            # first message of the worker
+            return
+        pending = self._pending[request_id]
+        if msg['sample'] is not None:
+            pending['samples'].append(msg['sample'])
+        pending['remaining'] -= 1
+        if pending['remaining'] == 0:
+            del self._pending[request_id]
+            if pending['samples']:
+                reply = merge_samples(pending['samples'])
+            else:
+                # no shard was ready to sample
+                reply = None
+            frontend.send_multipart([pending['client'], b'', U.serialize(reply)])
+
+    def _dispatch(self, backend):
+        while self._learner_requests and all(self._idle_workers):
+            client, batch_size = self._learner_requests.popleft()
+            total_weight = self._weights.sum()
+            if total_weight > 0:
+                batch_sizes = np.random.multinomial(
+                    batch_size, self._weights / total_weight)
+            else:
+                batch_sizes = np.zeros(self.shards, dtype=np.int64)
+            request_id = self._next_request_id
+            self._next_request_id += 1
+            self._pending[request_id] = {
+                'client': client,
+                'samples': [],
+                'remaining': self.shards,
+            }
+            for shard in range(self.shards):
+                task = {
+                    'request_id': request_id,
+                    'batch_size': int(batch_sizes[shard]),
+                    # nothing to sample yet, report the weight once ready
+                    'wait': total_weight <= 0,
+                }
+                worker = self._idle_workers[shard].popleft()
+                backend.send_multipart([worker, b'', U.serialize(task)])
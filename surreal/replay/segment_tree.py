@@ -1,6 +1,7 @@
 # Adapted from https://github.com/openai/baselines
 
 import operator
+import numpy as np
 
 
 class SegmentTree(object):
@@ -135,4 +136,134 @@ class MinSegmentTree(SegmentTree):
     def min(self, start=0, end=None):
         """Returns min(arr[start], ...,  arr[end])"""
 
-        return super(MinSegmentTree, self).reduce(start, end)
\ No newline at end of file
+        return super(MinSegmentTree, self).reduce(start, end)
+
+
+class NumpySegmentTree(object):
+    def __init__(self, capacity, operation, neutral_element):
+        """Array-backed version of SegmentTree.
+        Same interface, but __setitem__ and __getitem__ also accept
+        arrays of indices, and all nodes of a level are updated in one
+        vectorized operation.
+        Parameters
+        ---------
+        capacity: int
+            Total size of the array - must be a power of two.
+        operation: numpy ufunc (eg. np.add, np.minimum)
+            an operation for combining elements, must be applicable
+            elementwise to arrays.
+        neutral_element: float
+            neutral element for the operation above.
+        """
+        assert capacity > 0 and capacity & (capacity - 1) == 0, "capacity must be positive and a power of 2."
+        self._capacity = capacity
+        self._depth = capacity.bit_length() - 1
+        self._value = np.full(2 * capacity, neutral_element, dtype=np.float64)
+        self._operation = operation
+        self._neutral_element = neutral_element
+
+    def reduce(self, start=0, end=None):
+        """Returns result of applying `self.operation`
+        to a contiguous subsequence of the array.
+        O(1) if the whole array is reduced, O(lg capacity) otherwise.
+        Parameters
+        ----------
+        start: int
+            beginning of the subsequence
+        end: int
+            end of the subsequences
+        Returns
+        -------
+        reduced: float
+            result of reducing self.operation over the specified range of array elements.
+        """
+        if end is None:
+            end = self._capacity
+        if end < 0:
+            end += self._capacity
+        if start == 0 and end == self._capacity:
+            return float(self._value[1])
+        result = self._neutral_element
+        start += self._capacity
+        end += self._capacity
+        while start < end:
+            if start & 1:
+                result = self._operation(result, self._value[start])
+                start += 1
+            if end & 1:
+                end -= 1
+                result = self._operation(result, self._value[end])
+            start //= 2
+            end //= 2
+        return float(result)
+
+    def __setitem__(self, idx, val):
+        idx = np.atleast_1d(np.asarray(idx, dtype=np.int64)) + self._capacity
+        self._value[idx] = val
+        for _ in range(self._depth):
+            idx = np.unique(idx // 2)
+            self._value[idx] = self._operation(
+                self._value[2 * idx],
+                self._value[2 * idx + 1]
+            )
+
+    def __getitem__(self, idx):
+        if np.isscalar(idx):
+            assert 0 <= idx < self._capacity
+            return float(self._value[self._capacity + idx])
+        idx = np.asarray(idx, dtype=np.int64)
+        assert np.all((0 <= idx) & (idx < self._capacity))
+        return self._value[self._capacity + idx]
+
+
+class NumpySumSegmentTree(NumpySegmentTree):
+    def __init__(self, capacity):
+        super(NumpySumSegmentTree, self).__init__(
+            capacity=capacity,
+            operation=np.add,
+            neutral_element=0.0
+        )
+
+    def sum(self, start=0, end=None):
+        """Returns arr[start] + ... + arr[end]"""
+        return super(NumpySumSegmentTree, self).reduce(start, end)
+
+    def find_prefixsum_idx(self, prefixsum):
+        """Batched version of SumSegmentTree.find_prefixsum_idx
+        All masses descend the tree together, one level at a time.
+        Parameters
+        ----------
+        prefixsum: float or np.ndarray
+            upperbound(s) on the sum of array prefix
+        Returns
+        -------
+        idx: int or np.ndarray of int
+            highest index satisfying the prefixsum constraint,
+            for each element of prefixsum
+        """
+        scalar = np.isscalar(prefixsum)
+        prefixsum = np.array(prefixsum, dtype=np.float64, ndmin=1)
+        assert np.all(0 <= prefixsum) and np.all(prefixsum <= self.sum() + 1e-5)
+        idx = np.ones(len(prefixsum), dtype=np.int64)
+        for _ in range(self._depth):  # while non-leaf
+            left = self._value[2 * idx]
+            go_right = left <= prefixsum
+            prefixsum -= left * go_right
+            idx = 2 * idx + go_right
+        idx -= self._capacity
+        if scalar:
+            return int(idx[0])
+        return idx
+
+
+class NumpyMinSegmentTree(NumpySegmentTree):
+    def __init__(self, capacity):
+        super(NumpyMinSegmentTree, self).__init__(
+            capacity=capacity,
+            operation=np.minimum,
+            neutral_element=float('inf')
+        )
+
+    def min(self, start=0, end=None):
+        """Returns min(arr[start], ...,  arr[end])"""
+        return super(NumpyMinSegmentTree, self).reduce(start, end)
@@ -2,10 +2,20 @@ from multiprocessing import Process
 import os
 from caraml.zmq import ZmqProxyThread
 import surreal.utils as U
+from .sampling_coordinator import ShardSamplingCoordinator
 
 
 class ReplayLoadBalancer(object):
-    def __init__(self):
+    def __init__(self, weighted_sampling=False, shards=1):
+        """
+        Args:
+            weighted_sampling: split each learner batch across
+                all shards with ShardSamplingCoordinator
+                instead of proxying it to a free shard
+            shards: number of replay shards, for weighted_sampling
+        """
+        self.weighted_sampling = weighted_sampling
+        self.shards = shards
         self.sampler_proxy = None
         self.collector_proxy = None
 
@@ -24,10 +34,16 @@ class ReplayLoadBalancer(object):
             in_add=self.collector_frontend_add,
             out_add=self.collector_backend_add,
             pattern='router-dealer')
-        self.sampler_proxy = ZmqProxyThread(
-            in_add=self.sampler_frontend_add,
-            out_add=self.sampler_backend_add,
-            pattern='router-dealer')
+        if self.weighted_sampling:
+            self.sampler_proxy = ShardSamplingCoordinator(
+                frontend_add=self.sampler_frontend_add,
+                backend_add=self.sampler_backend_add,
+                shards=self.shards)
+        else:
+            self.sampler_proxy = ZmqProxyThread(
+                in_add=self.sampler_frontend_add,
+                out_add=self.sampler_backend_add,
+                pattern='router-dealer')
 
         self.collector_proxy.setDaemon(False)
         self.collector_proxy.start()
@@ -86,10 +102,16 @@ class ShardedReplay(object):
             in_add=self.collector_frontend_add,
             out_add=self.collector_backend_add,
             pattern='router-dealer')
-        self.sampler_proxy = ZmqProxyThread(
-            in_add=self.sampler_frontend_add,
-            out_add=self.sampler_backend_add,
-            pattern='router-dealer')
+        if self.learner_config.replay.weighted_sampling:
+            self.sampler_proxy = ShardSamplingCoordinator(
+                frontend_add=self.sampler_frontend_add,
+                backend_add=self.sampler_backend_add,
+                shards=self.shards)
+        else:
+            self.sampler_proxy = ZmqProxyThread(
+                in_add=self.sampler_frontend_add,
+                out_add=self.sampler_backend_add,
+                pattern='router-dealer')
 
         self.collector_proxy.start()
         self.sampler_proxy.start()
@@ -0,0 +1,992 @@
+"""
+Memory layouts for the replay buffers
+"""
+import collections
+import hashlib
+import json
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import surreal.utils as U
+from surreal.env import ActionType
+
+
+def iter_arrays(obj):
+    """
+    Yields the numpy arrays of a nested dict/list
+    """
+    if isinstance(obj, np.ndarray):
+        yield obj
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            yield from iter_arrays(value)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            yield from iter_arrays(value)
+
+
+def write_snapshot_state(state, folder):
+    """
+    Writes what snapshot_state() returned into folder,
+    arrays as .npy files and other values as .json files
+
+    Args:
+        state: {file name: np.array or json serializable value}
+    """
+    for name, value in state.items():
+        path = U.f_join(folder, name)
+        if isinstance(value, np.ndarray):
+            np.save(path, value)
+        else:
+            with open(path, 'w') as f:
+                json.dump(value, f)
+
+
+class RingStorage(object):
+    """
+        Bookkeeping shared by the storages: experiences occupy slots
+        [0, len) of a ring buffer, the oldest one is overwritten first.
+        Also records the parameter version that generated each experience.
+    """
+    def __init__(self, capacity):
+        """
+        Args:
+            capacity: max number of experiences
+        """
+        self.capacity = capacity
+        self._size = 0
+        self._next_idx = 0
+        self._versions = np.zeros(capacity, dtype=np.int64)
+        # highest param_version ever inserted
+        self.newest_version = 0
+
+    def _advance(self, exp_list, indices=None):
+        """
+        Reserves slots for exp_list
+
+        Args:
+            indices: if not None, distinct occupied slots to overwrite
+                instead of the oldest ones, see ReservoirSampler
+
+        Returns:
+            exp_list without the experiences that would be overwritten
+                within the same batch,
+            positions: slice or index array to assign exp_list to,
+            indices: index array of the slots
+        """
+        if indices is not None:
+            indices = np.asarray(indices, dtype=np.int64)
+            assert len(indices) == len(exp_list)
+            assert np.all(indices < self._size)
+            self._record_versions(indices, exp_list)
+            return exp_list, indices, indices
+        dropped = max(len(exp_list) - self.capacity, 0)
+        exp_list = exp_list[dropped:]
+        n = len(exp_list)
+        start = (self._next_idx + dropped) % self.capacity
+        indices = (start + np.arange(n)) % self.capacity
+        if start + n <= self.capacity:
+            positions = slice(start, start + n)
+        else:
+            positions = indices
+        self._record_versions(positions, exp_list)
+        self._next_idx = (start + n) % self.capacity
+        self._size = min(self._size + n, self.capacity)
+        return exp_list, positions, indices
+
+    def _record_versions(self, positions, exp_list):
+        versions = [exp.get('param_version', 0) for exp in exp_list]
+        self._versions[positions] = versions
+        if versions:
+            self.newest_version = max(self.newest_version, max(versions))
+
+    def evictions_needed(self, exp_list):
+        """
+        Returns:
+            number of oldest experiences to remove before exp_list
+            can be inserted, the slots themselves are always reused
+        """
+        return 0
+
+    def age_order(self):
+        """
+        Returns:
+            indices of all experiences, from oldest to newest
+        """
+        if self._size < self.capacity:
+            return np.arange(self._size)
+        return (self._next_idx + np.arange(self._size)) % self.capacity
+
+    def indices_by_age(self, ages):
+        """
+        Returns:
+            indices of the experiences inserted ages[i] experiences
+            before the newest one
+        """
+        return (self._next_idx - 1 - np.asarray(ages)) % self.capacity
+
+    def versions(self, indices):
+        """
+        Returns:
+            param_version sent by the agent with each experience,
+            0 if it did not send one
+        """
+        return self._versions[indices]
+
+    def fresh_indices(self, min_version):
+        """
+        Returns:
+            indices of the experiences with param_version >= min_version,
+            from oldest to newest
+        """
+        order = self.age_order()
+        return order[self._versions[order] >= min_version]
+
+    def remove(self, indices):
+        """
+        Deletes experiences at indices. The remaining ones are compacted
+        into slots [0, len) from oldest to newest so that the ring keeps
+        overwriting the oldest experience first.
+
+        Returns:
+            keep: keep[i] is the old index of the experience now at i
+        """
+        order = self.age_order()
+        keep = order[~np.isin(order, indices)]
+        self._reorder(keep)
+        self._size = len(keep)
+        self._next_idx = len(keep) % self.capacity
+        return keep
+
+    def _reorder(self, keep):
+        """
+        Moves the experiences (and their versions) at keep
+        into slots [0, len(keep))
+        """
+        raise NotImplementedError
+
+    def exp_nbytes(self, indices):
+        """
+        Returns:
+            array of the bytes held by each experience at indices
+        """
+        raise NotImplementedError
+
+    def nbytes(self):
+        """
+        Returns:
+            bytes held by the storage
+        """
+        raise NotImplementedError
+
+    def metrics(self):
+        """
+        Returns:
+            dict of storage specific values reported to tensorplex
+        """
+        return {}
+
+    def snapshot_state(self):
+        """
+        Copies what save() writes, so that the copy can be written
+        while experiences keep being inserted and sampled
+
+        Returns:
+            {file name: np.array or json serializable value}
+        """
+        raise NotImplementedError
+
+    def save(self, folder):
+        write_snapshot_state(self.snapshot_state(), folder)
+
+    def load(self, folder):
+        """
+        Restores what save() wrote into folder
+        """
+        raise NotImplementedError
+
+    def __len__(self):
+        return self._size
+
+
+class ListStorage(RingStorage):
+    """
+        Ring buffer that keeps each experience as the python object
+        sent by the agent
+    """
+    def __init__(self, capacity):
+        """
+        Args:
+            capacity: max number of experiences, the oldest ones are
+                overwritten first
+        """
+        super().__init__(capacity)
+        self._memory = []
+        # ExperienceCollectorServer hands out the same array object to
+        # every experience that references a given observation.
+        # id(array) -> [number of references, array.nbytes]
+        self._array_refs = {}
+        self._total_nbytes = 0
+        # each experience's share of the arrays it references at insert time
+        self._nbytes = np.zeros(capacity, dtype=np.int64)
+
+    def insert(self, exp_dict):
+        """
+        Returns:
+            index where exp_dict is stored
+        """
+        return self.insert_batch([exp_dict])[0]
+
+    def insert_batch(self, exp_list, indices=None):
+        """
+        Args:
+            indices: see RingStorage._advance
+
+        Returns:
+            array of indices where exp_list is stored
+        """
+        exp_list, _, indices = self._advance(exp_list, indices)
+        if len(indices) > 0:
+            # slots are not filled in order when part of
+            # an oversize batch is dropped
+            missing = int(indices.max()) + 1 - len(self._memory)
+            if missing > 0:
+                self._memory.extend([None] * missing)
+        for idx, exp_dict in zip(indices, exp_list):
+            if self._memory[idx] is not None:
+                self._release(self._memory[idx])
+            self._memory[idx] = exp_dict
+            self._nbytes[idx] = self._retain(exp_dict)
+        return indices
+
+    def _retain(self, exp_dict):
+        """
+        Returns:
+            share of exp_dict in the bytes of the arrays it references
+        """
+        share = 0.
+        for array in iter_arrays(exp_dict):
+            ref = self._array_refs.get(id(array))
+            if ref is None:
+                ref = self._array_refs[id(array)] = [0, array.nbytes]
+                self._total_nbytes += array.nbytes
+            ref[0] += 1
+            share += ref[1] / ref[0]
+        return int(share)
+
+    def _release(self, exp_dict):
+        for array in iter_arrays(exp_dict):
+            ref = self._array_refs[id(array)]
+            ref[0] -= 1
+            if ref[0] == 0:
+                self._total_nbytes -= ref[1]
+                del self._array_refs[id(array)]
+
+    def get(self, indices):
+        """
+        Returns:
+            list of experiences at indices
+        """
+        return [self._memory[i] for i in indices]
+
+    def _reorder(self, keep):
+        kept = set(keep.tolist())
+        for i, exp_dict in enumerate(self._memory):
+            if i not in kept:
+                self._release(exp_dict)
+        self._memory = [self._memory[i] for i in keep]
+        self._nbytes[:len(keep)] = self._nbytes[keep]
+        self._versions[:len(keep)] = self._versions[keep]
+
+    def exp_nbytes(self, indices):
+        return self._nbytes[indices]
+
+    def nbytes(self):
+        """
+        Bytes of the numpy arrays referenced by the experiences,
+        arrays shared between experiences are counted once
+        """
+        return self._total_nbytes
+
+    def snapshot_state(self):
+        raise NotImplementedError(
+            'Python objects cannot be snapshotted, use columnar storage')
+
+    def load(self, folder):
+        raise NotImplementedError(
+            'Python objects cannot be snapshotted, use columnar storage')
+
+
+class ColumnarStorage(RingStorage):
+    """
+        Preallocated numpy ring buffers, one per observation modality/key,
+        plus actions, rewards and dones.
+
+        Accepts experiences in the format of ExpSenderWrapperSSAR
+        get() returns already batched arrays, in the same format as
+        SSARAggregator.aggregate()
+        {
+            obs = batch_size * observation
+            obs_next = batch_size * next_observation
+            actions = batch_size * actions,
+            rewards = batch_size * 1,
+            dones = batch_size * 1,
+        }
+        `info` sent by the agents is not stored.
+    """
+    def __init__(self, capacity, obs_spec, action_spec):
+        """
+        Args:
+            capacity: number of experiences to preallocate
+            obs_spec, action_spec: see env_config, the storage shapes
+                are built from them
+        """
+        super().__init__(capacity)
+        self._obs = self._allocate_obs(obs_spec)
+        self._obs_next = self._allocate_obs(obs_spec)
+        self._actions = np.zeros((capacity,) + tuple(action_spec['dim']),
+                                 dtype=self._action_dtype(action_spec))
+        self._rewards = np.zeros((capacity, 1), dtype=np.float32)
+        self._dones = np.zeros((capacity, 1), dtype=np.float32)
+
+    @staticmethod
+    def _action_dtype(action_spec):
+        action_type = ActionType[action_spec['type']]
+        if action_type == ActionType.continuous:
+            return np.float32
+        elif action_type == ActionType.discrete:
+            return np.int32
+        else:
+            raise NotImplementedError(
+                'action_spec unsupported ' + str(action_spec))
+
+    @staticmethod
+    def _obs_dtype(modality):
+        # Pixels stay uint8 in memory, learner converts them to float
+        return np.uint8 if modality == 'pixel' else np.float32
+
+    @classmethod
+    def row_nbytes(cls, obs_spec, action_spec):
+        """
+        Returns:
+            bytes taken by one experience
+        """
+        nbytes = 0
+        for modality in obs_spec:
+            itemsize = np.dtype(cls._obs_dtype(modality)).itemsize
+            for shape in obs_spec[modality].values():
+                # obs and obs_next
+                nbytes += 2 * itemsize * int(np.prod(shape))
+        nbytes += (np.dtype(cls._action_dtype(action_spec)).itemsize
+                   * int(np.prod(action_spec['dim'])))
+        # rewards, dones and versions
+        nbytes += 4 + 4 + 8
+        return nbytes
+
+    def _allocate_obs(self, obs_spec):
+        columns = collections.OrderedDict()
+        for modality in obs_spec:
+            columns[modality] = collections.OrderedDict()
+            dtype = self._obs_dtype(modality)
+            for key, shape in obs_spec[modality].items():
+                columns[modality][key] = np.zeros(
+                    (self.capacity,) + tuple(shape), dtype=dtype)
+        return columns
+
+    def _obs_value(self, obs, modality, key):
+        value = obs[modality][key]
+        if isinstance(value, list):
+            # frames sent with frame_stack_concatenate_on_env=False
+            value = np.concatenate(value, axis=0)
+        return value
+
+    def _write_obs_batch(self, columns, positions, obs_list):
+        for modality in columns:
+            for key in columns[modality]:
+                columns[modality][key][positions] = np.stack(
+                    [self._obs_value(obs, modality, key) for obs in obs_list])
+
+    def _gather_obs(self, columns, indices):
+        batch = collections.OrderedDict()
+        for modality in columns:
+            batch[modality] = collections.OrderedDict()
+            for key in columns[modality]:
+                batch[modality][key] = columns[modality][key][indices]
+        return batch
+
+    def insert(self, exp_dict):
+        """
+        Returns:
+            index where exp_dict is stored
+        """
+        return self.insert_batch([exp_dict])[0]
+
+    def insert_batch(self, exp_list, indices=None):
+        """
+        Writes all experiences with one assignment per column
+
+        Args:
+            indices: see RingStorage._advance
+
+        Returns:
+            array of indices where exp_list is stored
+        """
+        exp_list, positions, indices = self._advance(exp_list, indices)
+        self._write_obs_batch(self._obs, positions,
+                              [exp['obs'][0] for exp in exp_list])
+        self._write_obs_batch(self._obs_next, positions,
+                              [exp['obs'][1] for exp in exp_list])
+        self._actions[positions] = np.stack(
+            [exp['action'] for exp in exp_list])
+        self._rewards[positions, 0] = [exp['reward'] for exp in exp_list]
+        self._dones[positions, 0] = [float(exp['done']) for exp in exp_list]
+        return indices
+
+    def get(self, indices):
+        """
+        Returns:
+            dict of batched arrays, fancy indexed at indices
+        """
+        indices = np.asarray(indices)
+        return {
+            'obs': self._gather_obs(self._obs, indices),
+            'obs_next': self._gather_obs(self._obs_next, indices),
+            'actions': self._actions[indices],
+            'rewards': self._rewards[indices],
+            'dones': self._dones[indices],
+        }
+
+    def _columns(self):
+        """
+        Yields (name, container, key) for every column,
+        the array itself is container[key]
+        """
+        for prefix, columns in (('obs', self._obs),
+                                ('obs_next', self._obs_next)):
+            for modality in columns:
+                for key in columns[modality]:
+                    yield ('.'.join([prefix, modality, key]),
+                           columns[modality], key)
+        for name in ('actions', 'rewards', 'dones', 'versions'):
+            yield name, self.__dict__, '_' + name
+
+    def _reorder(self, keep):
+        for _, container, key in self._columns():
+            container[key][:len(keep)] = container[key][keep]
+
+    def exp_nbytes(self, indices):
+        """
+        All experiences take the same space. Slots are reused,
+        evicting does not give memory back to the OS.
+        """
+        row_nbytes = sum(container[key][0].nbytes
+                         for _, container, key in self._columns())
+        return np.full(len(indices), row_nbytes, dtype=np.int64)
+
+    def nbytes(self):
+        """
+        All columns are preallocated
+        """
+        return sum(container[key].nbytes
+                   for _, container, key in self._columns())
+
+    def snapshot_state(self):
+        """
+        One .npy file per column plus metadata.json
+        """
+        state = {name + '.npy': np.array(container[key], copy=True)
+                 for name, container, key in self._columns()}
+        state['metadata.json'] = {
+            'capacity': self.capacity,
+            'size': self._size,
+            'next_idx': self._next_idx,
+            'newest_version': int(self.newest_version),
+        }
+        return state
+
+    def load(self, folder):
+        """
+        Memory-maps the columns written by save(). Pages are read lazily
+        and copied on write, the files on disk are never modified.
+        """
+        with open(U.f_join(folder, 'metadata.json')) as f:
+            metadata = json.load(f)
+        if metadata['capacity'] != self.capacity:
+            raise ValueError('Snapshot capacity {} does not match replay '
+                             'capacity {}'.format(metadata['capacity'],
+                                                  self.capacity))
+        columns = []
+        for name, container, key in self._columns():
+            array = self._load_column(U.f_join(folder, name + '.npy'),
+                                      container[key])
+            if (array.shape != container[key].shape
+                    or array.dtype != container[key].dtype):
+                raise ValueError('Snapshot column {} has shape {} {}, '
+                                 'expected {} {}'.format(
+                                     name, array.shape, array.dtype,
+                                     container[key].shape,
+                                     container[key].dtype))
+            columns.append((container, key, array))
+        for container, key, array in columns:
+            container[key] = array
+        self._size = metadata['size']
+        self._next_idx = metadata['next_idx']
+        self.newest_version = metadata.get('newest_version', 0)
+
+    def _load_column(self, path, column):
+        return np.load(path, mmap_mode='c')
+
+    def __len__(self):
+        return self._size
+
+
+class CompressedColumnarStorage(ColumnarStorage):
+    """
+        ColumnarStorage that keeps each pixel observation compressed,
+        low dimensional observations stay raw. Only the sampled
+        observations are decompressed, by a pool of threads
+        (zlib and lz4 release the GIL).
+    """
+    def __init__(self, capacity, obs_spec, action_spec,
+                 codec='zlib', level=1, decompress_threads=4):
+        """
+        Args:
+            capacity, obs_spec, action_spec: see ColumnarStorage
+            codec: 'zlib' or 'lz4', lz4 requires the lz4 package
+            level: compression level
+            decompress_threads: size of the decompression thread pool
+        """
+        self._obs_shapes = {modality: dict(obs_spec[modality])
+                            for modality in obs_spec}
+        if codec == 'zlib':
+            self._compress = lambda data: zlib.compress(data, level)
+            self._decompress = zlib.decompress
+        elif codec == 'lz4':
+            import lz4.frame
+            self._compress = lambda data: lz4.frame.compress(
+                data, compression_level=level)
+            self._decompress = lz4.frame.decompress
+        else:
+            raise ValueError('Unknown compression codec: {}'.format(codec))
+        super().__init__(capacity, obs_spec, action_spec)
+        # bytes of the compressed pixels of each experience
+        self._compressed_nbytes = np.zeros(capacity, dtype=np.int64)
+        self._raw_pixel_nbytes = 2 * sum(
+            int(np.prod(shape)) for shape in obs_spec.get('pixel', {}).values())
+        self._executor = ThreadPoolExecutor(max_workers=decompress_threads)
+        self.decompress_time = U.TimeRecorder()
+
+    def _allocate_obs(self, obs_spec):
+        columns = super()._allocate_obs(
+            {modality: obs_spec[modality]
+             for modality in obs_spec if modality != 'pixel'})
+        if 'pixel' in obs_spec:
+            columns['pixel'] = collections.OrderedDict()
+            for key in obs_spec['pixel']:
+                columns['pixel'][key] = np.empty(self.capacity, dtype=object)
+        return columns
+
+    def _write_obs_batch(self, columns, positions, obs_list):
+        for modality in columns:
+            for key in columns[modality]:
+                if modality != 'pixel':
+                    columns[modality][key][positions] = np.stack(
+                        [self._obs_value(obs, modality, key) for obs in obs_list])
+                    continue
+                blobs = np.empty(len(obs_list), dtype=object)
+                for i, obs in enumerate(obs_list):
+                    value = np.ascontiguousarray(
+                        self._obs_value(obs, modality, key), dtype=np.uint8)
+                    blobs[i] = self._compress(value)
+                columns[modality][key][positions] = blobs
+
+    def insert_batch(self, exp_list, indices=None):
+        indices = super().insert_batch(exp_list, indices)
+        self._compressed_nbytes[indices] = 0
+        for columns in (self._obs, self._obs_next):
+            for column in columns.get('pixel', {}).values():
+                self._compressed_nbytes[indices] += [len(blob) for blob in column[indices]]
+        return indices
+
+    def _gather_obs(self, columns, indices):
+        batch = collections.OrderedDict()
+        for modality in columns:
+            batch[modality] = collections.OrderedDict()
+            for key in columns[modality]:
+                if modality == 'pixel':
+                    batch[modality][key] = self._decompress_column(
+                        columns[modality][key], indices,
+                        self._obs_shapes[modality][key])
+                else:
+                    batch[modality][key] = columns[modality][key][indices]
+        return batch
+
+    def _decompress_column(self, column, indices, shape):
+        out = np.empty((len(indices),) + tuple(shape), dtype=np.uint8)
+
+        def decompress(i):
+            out[i] = np.frombuffer(self._decompress(column[indices[i]]),
+                                   dtype=np.uint8).reshape(shape)
+
+        with self.decompress_time.time():
+            # consume the iterator to propagate exceptions
+            list(self._executor.map(decompress, range(len(indices))))
+        return out
+
+    def _columns(self):
+        yield from super()._columns()
+        yield 'compressed_nbytes', self.__dict__, '_compressed_nbytes'
+
+    def _load_column(self, path, column):
+        if column.dtype == object:
+            # compressed pixels are pickled, they cannot be memory-mapped
+            return np.load(path, allow_pickle=True)
+        return super()._load_column(path, column)
+
+    def _raw_row_nbytes(self):
+        """
+        Bytes of one experience in the uncompressed columns
+        """
+        return sum(container[key][0].nbytes
+                   for _, container, key in self._columns()
+                   if container[key].dtype != object)
+
+    def exp_nbytes(self, indices):
+        return self._raw_row_nbytes() + self._compressed_nbytes[indices]
+
+    def nbytes(self):
+        """
+        Preallocated columns plus the compressed pixels
+        """
+        return (sum(container[key].nbytes
+                    for _, container, key in self._columns()
+                    if container[key].dtype != object)
+                + int(self._compressed_nbytes[:self._size].sum()))
+
+    def metrics(self):
+        compressed = int(self._compressed_nbytes[:self._size].sum())
+        return {
+            'compression_ratio':
+                self._raw_pixel_nbytes * self._size / compressed if compressed else 0,
+            'decompress_time_s': self.decompress_time.avg,
+        }
+
+
+class FrameStackStorage(ColumnarStorage):
+    """
+        ColumnarStorage that stores every distinct pixel frame once.
+        Pixel observations are stacks of frame_stacks frames, as lists
+        (frame_stack_concatenate_on_env=False) or already concatenated.
+        Frames go into a ring of frames, deduplicated by content, and
+        each experience keeps the indices of its frames. get() rebuilds
+        the stacks with one gather per key.
+    """
+    def __init__(self, capacity, obs_spec, action_spec,
+                 frame_stacks, frames_per_exp=2):
+        """
+        Args:
+            capacity, obs_spec, action_spec: see ColumnarStorage
+            frame_stacks: see env_config, pixel shapes in obs_spec
+                are frame_stacks frames concatenated
+            frames_per_exp: size of the frame ring, per experience.
+                Consecutive experiences of an episode share all frames
+                but one, see evictions_needed when the ring fills up
+        """
+        self.frame_stacks = frame_stacks
+        self.frame_capacity = int(capacity * frames_per_exp)
+        self._frame_shapes = collections.OrderedDict()
+        for key, shape in obs_spec.get('pixel', {}).items():
+            self._frame_shapes[key] = ((shape[0] // frame_stacks,)
+                                       + tuple(shape[1:]))
+        super().__init__(capacity, obs_spec, action_spec)
+        self._frames = {}
+        # number of experience slots referencing each frame,
+        # frames that are not referenced are reused oldest first
+        self._frame_refs = {}
+        self._frame_digests = {}
+        self._frame_index = {}
+        self._next_frame = {}
+        for key, shape in self._frame_shapes.items():
+            self._frames[key] = np.zeros((self.frame_capacity,) + shape,
+                                         dtype=np.uint8)
+            self._frame_refs[key] = np.zeros(self.frame_capacity, dtype=np.int32)
+            self._frame_digests[key] = [None] * self.frame_capacity
+            self._frame_index[key] = {}
+            self._next_frame[key] = 0
+
+    @classmethod
+    def row_nbytes(cls, obs_spec, action_spec, frame_stacks=1, frames_per_exp=2):
+        nbytes = super().row_nbytes(
+            {modality: obs_spec[modality]
+             for modality in obs_spec if modality != 'pixel'},
+            action_spec)
+        for shape in obs_spec.get('pixel', {}).values():
+            frame_nbytes = int(np.prod(shape)) // frame_stacks
+            # frame indices of obs and obs_next, frames and their refcounts
+            nbytes += 2 * frame_stacks * 4 + frames_per_exp * (frame_nbytes + 4)
+        return nbytes
+
+    def _allocate_obs(self, obs_spec):
+        columns = super()._allocate_obs(
+            {modality: obs_spec[modality]
+             for modality in obs_spec if modality != 'pixel'})
+        if 'pixel' in obs_spec:
+            columns['pixel'] = collections.OrderedDict()
+            for key in obs_spec['pixel']:
+                # frame indices, -1 in empty slots
+                columns['pixel'][key] = np.full(
+                    (self.capacity, self.frame_stacks), -1, dtype=np.int32)
+        return columns
+
+    def _split_frames(self, value):
+        if isinstance(value, list):
+            return value
+        return np.split(np.asarray(value), self.frame_stacks, axis=0)
+
+    @staticmethod
+    def _frame_digest(frame):
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        return hashlib.blake2b(frame, digest_size=16).digest()
+
+    def evictions_needed(self, exp_list):
+        """
+        Every experience can reference 2 * frame_stacks frames that are
+        not shared with any other. Once the frame rings are full the
+        oldest experiences have to go to release their frames.
+        """
+        if not self._frames:
+            return 0
+        frame_count = 2 * self.frame_stacks * len(exp_list)
+        if all(np.count_nonzero(refs == 0) >= frame_count
+               for refs in self._frame_refs.values()):
+            return 0
+        order = self.age_order()
+        needed = 0
+        for key in self._frames:
+            digests = {self._frame_digest(frame)
+                       for exp in exp_list for obs in exp['obs']
+                       for frame in self._split_frames(obs['pixel'][key])}
+            stored = np.array([self._frame_index[key][digest]
+                               for digest in digests
+                               if digest in self._frame_index[key]],
+                              dtype=np.int64)
+            refs = self._frame_refs[key].copy()
+            n = 0
+            # frames of exp_list that are not referenced count as new,
+            # their slot may be reused before they are looked up
+            while (len(digests) - np.count_nonzero(refs[stored])
+                   > np.count_nonzero(refs == 0)) and n < len(order):
+                for columns in (self._obs, self._obs_next):
+                    slots = columns['pixel'][key][order[n]]
+                    np.subtract.at(refs, slots[slots >= 0], 1)
+                n += 1
+            needed = max(needed, n)
+        return needed
+
+    def _retain_frame(self, key, frame):
+        """
+        Returns:
+            index of frame in the ring of key, stored if it is new
+        """
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        digest = self._frame_digest(frame)
+        slot = self._frame_index[key].get(digest)
+        if slot is None:
+            slot = self._free_frame(key)
+            old_digest = self._frame_digests[key][slot]
+            if old_digest is not None:
+                del self._frame_index[key][old_digest]
+            self._frames[key][slot] = frame
+            self._frame_digests[key][slot] = digest
+            self._frame_index[key][digest] = slot
+        self._frame_refs[key][slot] += 1
+        return slot
+
+    def _free_frame(self, key):
+        refs = self._frame_refs[key]
+        slot = self._next_frame[key]
+        for _ in range(self.frame_capacity):
+            if refs[slot] == 0:
+                self._next_frame[key] = (slot + 1) % self.frame_capacity
+                return slot
+            slot = (slot + 1) % self.frame_capacity
+        raise RuntimeError('All {} frames are referenced, increase '
+                           'learner_config.replay.frames_per_exp'
+                           .format(self.frame_capacity))
+
+    def _release_frames(self, key, rows):
+        slots = rows[rows >= 0]
+        np.subtract.at(self._frame_refs[key], slots, 1)
+
+    def _write_obs_batch(self, columns, positions, obs_list):
+        for modality in columns:
+            for key in columns[modality]:
+                if modality != 'pixel':
+                    columns[modality][key][positions] = np.stack(
+                        [self._obs_value(obs, modality, key) for obs in obs_list])
+                    continue
+                column = columns[modality][key]
+                # frames of overwritten experiences
+                self._release_frames(key, column[positions])
+                column[positions] = [
+                    [self._retain_frame(key, frame)
+                     for frame in self._split_frames(obs[modality][key])]
+                    for obs in obs_list]
+
+    def _gather_obs(self, columns, indices):
+        batch = collections.OrderedDict()
+        for modality in columns:
+            batch[modality] = collections.OrderedDict()
+            for key in columns[modality]:
+                if modality != 'pixel':
+                    batch[modality][key] = columns[modality][key][indices]
+                    continue
+                frames = self._frames[key][columns[modality][key][indices]]
+                # (batch, frame_stacks, C, H, W) -> (batch, frame_stacks * C, H, W)
+                batch[modality][key] = frames.reshape(
+                    (len(indices), -1) + self._frame_shapes[key][1:])
+        return batch
+
+    def _reorder(self, keep):
+        removed = np.setdiff1d(np.arange(self._size), keep)
+        for columns in (self._obs, self._obs_next):
+            for key, column in columns.get('pixel', {}).items():
+                self._release_frames(key, column[removed])
+        super()._reorder(keep)
+        for columns in (self._obs, self._obs_next):
+            for column in columns.get('pixel', {}).values():
+                column[len(keep):self._size] = -1
+
+    def exp_nbytes(self, indices):
+        """
+        Columns of the experience plus its share of the stored frames
+        """
+        row_nbytes = sum(container[key][0].nbytes
+                         for _, container, key in self._columns())
+        for key, frames in self._frames.items():
+            live_frames = np.count_nonzero(self._frame_refs[key])
+            if self._size:
+                row_nbytes += frames[0].nbytes * live_frames // self._size
+        return np.full(len(indices), row_nbytes, dtype=np.int64)
+
+    def nbytes(self):
+        """
+        All columns and frame rings are preallocated
+        """
+        return super().nbytes() + sum(
+            self._frames[key].nbytes + self._frame_refs[key].nbytes
+            for key in self._frames)
+
+    def metrics(self):
+        """
+        frame_dedup_ratio: frames referenced by the experiences
+            over distinct frames stored
+        """
+        live_frames = sum(np.count_nonzero(refs)
+                          for refs in self._frame_refs.values())
+        referenced = sum(refs.sum() for refs in self._frame_refs.values())
+        return {
+            'frame_dedup_ratio': referenced / live_frames if live_frames else 0,
+        }
+
+    def snapshot_state(self):
+        state = super().snapshot_state()
+        for key in self._frames:
+            state['frames.{}.npy'.format(key)] = \
+                np.array(self._frames[key], copy=True)
+            state['frame_refs.{}.npy'.format(key)] = \
+                np.array(self._frame_refs[key], copy=True)
+        state['frames.json'] = dict(self._next_frame)
+        return state
+
+    def load(self, folder):
+        super().load(folder)
+        with open(U.f_join(folder, 'frames.json')) as f:
+            self._next_frame = json.load(f)
+        for key in self._frames:
+            frames = np.load(U.f_join(folder, 'frames.{}.npy'.format(key)),
+                             mmap_mode='c')
+            if frames.shape != self._frames[key].shape:
+                raise ValueError('Snapshot frames {} have shape {}, expected {}'
+                                 .format(key, frames.shape,
+                                         self._frames[key].shape))
+            self._frames[key] = frames
+            self._frame_refs[key] = np.load(
+                U.f_join(folder, 'frame_refs.{}.npy'.format(key)))
+            self._frame_digests[key] = [None] * self.frame_capacity
+            self._frame_index[key] = {}
+            for slot in np.flatnonzero(self._frame_refs[key]):
+                digest = hashlib.blake2b(frames[slot], digest_size=16).digest()
+                self._frame_digests[key][slot] = digest
+                self._frame_index[key][digest] = slot
+
+
+class FIFOStorage(object):
+    """
+        Bounded queue of experiences for FIFOReplay: a preallocated ring
+        of python objects that push_batch() and pop_n() fill and empty
+        one slice at a time. Not thread safe, FIFOReplay calls it with
+        the memory lock held.
+    """
+    def __init__(self, capacity):
+        """
+        Args:
+            capacity: max number of queued experiences
+        """
+        self.capacity = capacity
+        self._ring = [None] * capacity
+        # slot of the oldest experience
+        self._head = 0
+        self._size = 0
+
+    def free(self):
+        return self.capacity - self._size
+
+    def push_batch(self, exp_list):
+        """
+        Appends as many experiences of exp_list as fit
+
+        Returns:
+            number of experiences appended
+        """
+        n = min(len(exp_list), self.free())
+        tail = (self._head + self._size) % self.capacity
+        first = min(n, self.capacity - tail)
+        self._ring[tail:tail + first] = exp_list[:first]
+        self._ring[:n - first] = exp_list[first:n]
+        self._size += n
+        return n
+
+    def pop_n(self, n):
+        """
+        Returns:
+            list of the n oldest experiences, removed from the queue
+        """
+        assert n <= self._size
+        end = self._head + n
+        if end <= self.capacity:
+            exps = self._ring[self._head:end]
+            self._ring[self._head:end] = [None] * n
+        else:
+            end -= self.capacity
+            exps = self._ring[self._head:] + self._ring[:end]
+            self._ring[self._head:] = [None] * (self.capacity - self._head)
+            self._ring[:end] = [None] * end
+        self._head = end % self.capacity
+        self._size -= n
+        return exps
+
+    def retain(self, predicate):
+        """
+        Drops the experiences for which predicate is False, keeping order
+
+        Returns:
+            number of experiences dropped
+        """
+        exps = self.pop_n(self._size)
+        kept = [exp for exp in exps if predicate(exp)]
+        self.push_batch(kept)
+        return len(exps) - len(kept)
+
+    def __len__(self):
+        return self._size
@@ -0,0 +1,175 @@
+import numpy as np
+from collections import deque
+from .base import Replay
+from surreal.session import ConfigError
+
+
+class TrajectoryReplay(Replay):
+    """
+    Stores the trajectory segments sent by ExpSenderWrapperTrajectory(WithInfo)
+    so that each step is stored once, and materializes the n-step windows
+    at sample time.
+
+    learner_config.replay.trajectory.window_format:
+      'multistep': windows in ExpSenderWrapperMultiStepMovingWindowWithInfo
+        format, starting every learner_config.algo.stride steps
+      'ssar': windows in ExpSenderWrapperSSARNStepBootstrap format,
+        starting at every step
+    learner_config.replay.trajectory.sampling:
+      'fifo': each window is sampled once, in arrival order. Same session
+        config requirements as FIFOReplay
+      'uniform': windows are sampled uniformly with replacement
+
+    memory_size counts windows, a segment is dropped once none of its
+    windows are held anymore.
+
+    With learner_config.replay.sampler.max_staleness, segments more than
+    max_staleness learner iterations behind the newest param_version are
+    not stored, and windows of stored ones are dropped as soon as
+    a newer version arrives.
+    """
+    def __init__(self,
+                 learner_config,
+                 env_config,
+                 session_config,
+                 index=0):
+        super().__init__(
+            learner_config=learner_config,
+            env_config=env_config,
+            session_config=session_config,
+            index=index,
+        )
+        self.batch_size = self.learner_config.replay.batch_size
+        self.memory_size = self.learner_config.replay.memory_size
+        self.n_step = self.learner_config.algo.n_step
+        self.window_format = self.learner_config.replay.trajectory.window_format
+        self.sampling = self.learner_config.replay.trajectory.sampling
+        if self.window_format == 'multistep':
+            # same as ExpSenderWrapperTrajectory
+            self.stride = min(self.learner_config.algo.stride, self.n_step)
+        elif self.window_format == 'ssar':
+            self.stride = 1
+            self.gamma = self.learner_config.algo.gamma
+        else:
+            raise ConfigError('Unknown trajectory window format: {}'
+                              .format(self.window_format))
+
+        if self.sampling == 'fifo':
+            self._windows = deque(maxlen=self.memory_size + 3)  # + 3 for a gentle buffering
+            assert self.session_config.replay.max_puller_queue <= 10
+            assert self.session_config.replay.max_prefetch_queue == 1
+        elif self.sampling == 'uniform':
+            self._windows = []
+            self._next_idx = 0
+        else:
+            raise ConfigError('Unknown trajectory sampling: {}'
+                              .format(self.sampling))
+        self._max_staleness = self.learner_config.replay.sampler.max_staleness
+        self._newest_version = 0
+        if self.session_config.replay.evict_interval:
+            raise ConfigError('TrajectoryReplay does not support eviction, '
+                              'unset session_config.replay.evict_interval, '
+                              'see learner_config.replay.sampler.max_staleness')
+
+    def insert(self, exp_dict):
+        self.insert_batch([exp_dict])
+
+    def insert_batch(self, exp_list):
+        newest = max(segment.get('param_version', 0) for segment in exp_list)
+        if newest > self._newest_version:
+            self._newest_version = newest
+            if self._max_staleness is not None:
+                self._drop_stale()
+        for segment in exp_list:
+            window_starts = self._window_starts(segment)
+            if (self._max_staleness is not None
+                    and segment.get('param_version', 0)
+                    < self._newest_version - self._max_staleness):
+                # lagging agents keep sending stale segments
+                self.cumulative_evicted_count += len(window_starts)
+                continue
+            for t in window_starts:
+                self._add_window((segment, t))
+
+    def _window_starts(self, segment):
+        first = -segment['start'] % self.stride
+        last = len(segment['obs']) - self.n_step
+        return range(first, last + 1, self.stride)
+
+    def _drop_stale(self):
+        min_version = self._newest_version - self._max_staleness
+        if self.sampling == 'fifo':
+            windows = self._windows
+        else:
+            # oldest first
+            windows = (self._windows[self._next_idx:]
+                       + self._windows[:self._next_idx])
+        fresh = [window for window in windows
+                 if window[0].get('param_version', 0) >= min_version]
+        self.cumulative_evicted_count += len(self._windows) - len(fresh)
+        if self.sampling == 'fifo':
+            self._windows = deque(fresh, maxlen=self._windows.maxlen)
+        else:
+            self._windows = fresh
+            self._next_idx = 0
+
+    def _add_window(self, window):
+        if self.sampling == 'fifo':
+            self._windows.append(window)
+        elif len(self._windows) < self.memory_size:
+            self._windows.append(window)
+        else:
+            self._windows[self._next_idx] = window
+            self._next_idx = (self._next_idx + 1) % self.memory_size
+
+    def sample(self, batch_size):
+        if self.sampling == 'fifo':
+            assert batch_size <= self.memory_size
+            windows = [self._windows.popleft() for _ in range(batch_size)]
+        else:
+            indices = np.random.randint(len(self._windows), size=batch_size)
+            windows = [self._windows[i] for i in indices]
+        self.record_staleness([self._newest_version
+                               - segment.get('param_version', 0)
+                               for segment, _ in windows])
+        return [self._materialize(segment, t) for segment, t in windows]
+
+    def _materialize(self, segment, t):
+        """
+        Builds the window of n_step steps starting at step t of the segment
+        """
+        end = t + self.n_step
+        if end < len(segment['obs']):
+            obs_next = segment['obs'][end]
+        else:
+            obs_next = segment['obs_next']
+        if self.window_format == 'ssar':
+            reward = 0.
+            for i, r in enumerate(segment['rewards'][t:end]):
+                reward += self.gamma ** i * r
+            return {
+                'obs': [segment['obs'][t], obs_next],
+                'action': segment['actions'][t],
+                'reward': reward,
+                'done': segment['dones'][end - 1],
+                'info': segment['infos'][t],
+            }
+        return {
+            'obs': segment['obs'][t:end],
+            'obs_next': obs_next,
+            'actions': segment['actions'][t:end],
+            'onetime_infos': segment['onetime_infos'][t],
+            'persistent_infos': segment['persistent_infos'][t:end],
+            'rewards': segment['rewards'][t:end],
+            'dones': segment['dones'][t:end],
+            'infos': segment['infos'][t:end],
+            'n_step': self.n_step,
+        }
+
+    def start_sample_condition(self):
+        if self.sampling == 'fifo':
+            return len(self) >= self.batch_size
+        return len(self) > self.learner_config.replay.sampling_start_size
+
+    def __len__(self):
+        return len(self._windows)
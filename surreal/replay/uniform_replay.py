@@ -1,9 +1,17 @@
-import random
+import json
+import numpy as np
 from .base import Replay
+from .storage import (ListStorage, ColumnarStorage, CompressedColumnarStorage,
+                      FrameStackStorage)
+from .samplers import make_index_sampler
+from surreal.session import ConfigError
 import surreal.utils as U
 
 
 class UniformReplay(Replay):
+    # supported learner_config.replay.evict.policy
+    EVICT_POLICIES = ('oldest', 'stale')
+
     def __init__(self,
                  learner_config,
                  env_config,
@@ -14,6 +22,21 @@ class UniformReplay(Replay):
           memory_size: Max number of experience to store in the buffer.
             When the buffer overflows the old memories are dropped.
           sampling_start_size: min number of exp above which we will start sampling
+          storage: 'list' keeps the experience dicts as sent by the agents,
+            'columnar' preallocates numpy arrays from env_config.obs_spec
+            and action_spec, sample() then returns an aggregated batch
+            'compressed' is columnar with pixels compressed following
+            learner_config.replay.compression
+            'frame_stack' is columnar with each distinct pixel frame
+            stored once, for env_config.frame_stacks > 1
+          sampler: which experiences are sampled, see make_index_sampler
+            sampler.max_staleness: if not None, only experiences at most
+            this many learner iterations behind the newest param_version
+            are sampled
+          memory_bytes: if not None, bounds the memory held by experiences.
+            columnar and frame_stack storages preallocate as many experiences as fit,
+            list and compressed storages evict the oldest experiences
+            when it is exceeded
         """
         super().__init__(
             learner_config=learner_config,
@@ -21,9 +44,63 @@ class UniformReplay(Replay):
             session_config=session_config,
             index=index
         )
-        self._memory = []
+        self.memory_bytes = self.learner_config.replay.memory_bytes
         self.memory_size = self.learner_config.replay.memory_size
-        self._next_idx = 0
+        self._memory = self._create_storage()
+        self.memory_size = self._memory.capacity
+        self._sampler = make_index_sampler(self.learner_config.replay.sampler)
+        self._max_staleness = self.learner_config.replay.sampler.max_staleness
+        # evict() runs on the evict thread, fail here instead
+        evict_policy = self.learner_config.replay.evict.policy
+        if evict_policy not in self.EVICT_POLICIES:
+            raise ConfigError('Unsupported eviction policy for {}: {}'.format(
+                type(self).__name__, evict_policy))
+        if (self.session_config.checkpoint.replay.snapshot_interval
+                and self.learner_config.replay.storage == 'list'):
+            raise ConfigError('Replay snapshots require '
+                              'learner_config.replay.storage = "columnar", '
+                              '"compressed" or "frame_stack"')
+
+    def _create_storage(self):
+        storage = self.learner_config.replay.storage
+        if storage == 'list':
+            return ListStorage(self.memory_size)
+        elif storage == 'columnar':
+            capacity = self.memory_size
+            if self.memory_bytes is not None:
+                capacity = self.memory_bytes // ColumnarStorage.row_nbytes(
+                    self.env_config.obs_spec, self.env_config.action_spec)
+                self.log.info('Replay memory of {} bytes holds {} experiences'
+                              .format(self.memory_bytes, capacity))
+            return ColumnarStorage(capacity,
+                                   obs_spec=self.env_config.obs_spec,
+                                   action_spec=self.env_config.action_spec)
+        elif storage == 'compressed':
+            compression = self.learner_config.replay.compression
+            return CompressedColumnarStorage(
+                self.memory_size,
+                obs_spec=self.env_config.obs_spec,
+                action_spec=self.env_config.action_spec,
+                codec=compression.codec,
+                level=compression.level,
+                decompress_threads=compression.decompress_threads)
+        elif storage == 'frame_stack':
+            frames_per_exp = self.learner_config.replay.frames_per_exp
+            capacity = self.memory_size
+            if self.memory_bytes is not None:
+                capacity = self.memory_bytes // FrameStackStorage.row_nbytes(
+                    self.env_config.obs_spec, self.env_config.action_spec,
+                    frame_stacks=self.env_config.frame_stacks,
+                    frames_per_exp=frames_per_exp)
+                self.log.info('Replay memory of {} bytes holds {} experiences'
+                              .format(self.memory_bytes, capacity))
+            return FrameStackStorage(capacity,
+                                     obs_spec=self.env_config.obs_spec,
+                                     action_spec=self.env_config.action_spec,
+                                     frame_stacks=self.env_config.frame_stacks,
+                                     frames_per_exp=frames_per_exp)
+        else:
+            raise ConfigError('Unknown replay storage: {}'.format(storage))
 
     # def default_config(self):
     #     conf = super().default_config()
@@ -34,38 +111,135 @@ class UniformReplay(Replay):
     #     return conf
 
     def insert(self, exp_dict):
-        if self._next_idx >= len(self._memory):
-            self._memory.append(exp_dict)
-        else:
-            self._memory[self._next_idx] = exp_dict
-        self._next_idx = (self._next_idx + 1) % self.memory_size
+        self.insert_batch([exp_dict])
+
+    def insert_batch(self, exp_list):
+        self._make_room(exp_list)
+        self._sampler.insert_batch(self._memory, exp_list)
+        self._enforce_memory_bytes()
+
+    def memory_nbytes(self):
+        return self._memory.nbytes()
+
+    def storage_metrics(self):
+        return self._memory.metrics()
+
+    def _make_room(self, exp_list):
+        """
+        Evicts the oldest experiences if the storage cannot hold
+        exp_list otherwise, see FrameStackStorage.evictions_needed
+        """
+        n = self._memory.evictions_needed(exp_list)
+        if n == 0:
+            return
+        indices = self._memory.age_order()[:n]
+        self.cumulative_evicted_bytes += int(
+            self._memory.exp_nbytes(indices).sum())
+        self._remove(indices)
+        self.cumulative_evicted_count += n
+
+    def _enforce_memory_bytes(self):
+        """
+        Evicts the oldest experiences if storage exceeds memory_bytes
+        """
+        if (self.memory_bytes is None
+                or self._memory.nbytes() <= self.memory_bytes):
+            return
+        # go slightly below the budget so that this does not run
+        # (and compact the storage) on every insert
+        target = 0.99 * self.memory_bytes
+        while self._memory.nbytes() > target and len(self) > 0:
+            nbytes = self._memory.nbytes()
+            n = int(np.ceil((nbytes - target) / (nbytes / len(self))))
+            self._remove(self._memory.age_order()[:n])
+            self.cumulative_evicted_count += n
+            self.cumulative_evicted_bytes += nbytes - self._memory.nbytes()
+
+    def snapshot_state(self):
+        state = self._memory.snapshot_state()
+        state['sampler.json'] = self._sampler.state_dict()
+        return state
 
-    def sample(self, batch_size):    
-        indices = [random.randint(0, len(self._memory) - 1)
-                   for _ in range(batch_size)]
-        response = [self._memory[i] for i in indices]
-        return response
+    def restore_snapshot(self, folder):
+        self._memory.load(folder)
+        sampler_path = U.f_join(folder, 'sampler.json')
+        if U.f_exists(sampler_path):
+            with open(sampler_path) as f:
+                self._sampler.load_state_dict(json.load(f))
+
+    def sample(self, batch_size):
+        candidates = None
+        if self._max_staleness is not None:
+            candidates = self._memory.fresh_indices(
+                self._memory.newest_version - self._max_staleness)
+            if len(candidates) == 0:
+                # the experiences of the newest version received were
+                # all overwritten, evicted or not restored
+                candidates = self._memory.age_order()[-batch_size:]
+        indices = self._sampler.sample(self._memory, batch_size, candidates)
+        self.record_staleness(self._memory.newest_version
+                              - self._memory.versions(indices))
+        return self._memory.get(indices)
 
     def evict(self):
-        raise NotImplementedError  # TODO
-        if evict_size > len(self._memory):
-            evicted = self._memory
-            self._memory = []
-            self._next_idx = 0
-            return evicted
-        forward_space = len(self._memory) - self._next_idx
-        if evict_size < forward_space:
-            evicted = self._memory[self._next_idx:self._next_idx+evict_size]
-            del self._memory[self._next_idx:self._next_idx+evict_size]
+        """
+        Evicts following learner_config.replay.evict.policy
+            oldest: oldest experiences first, until the replay holds at
+                most evict.max_bytes
+            stale: all experiences whose param_version is more than
+                evict.max_staleness behind the newest one
+
+        Returns:
+            number of bytes evicted
+        """
+        evict_config = self.learner_config.replay.evict
+        if evict_config.policy == 'stale':
+            indices = self._stale_indices(evict_config.max_staleness)
         else:
-            evicted = self._memory[self._next_idx:]
-            evict_from_left = evict_size - forward_space
-            evicted += self._memory[:evict_from_left]
-            del self._memory[self._next_idx:]
-            del self._memory[:evict_from_left]
-            self._next_idx -= evict_from_left
-        assert len(evicted) == evict_size
-        return evicted
+            indices = self._over_budget(self._eviction_order(evict_config.policy),
+                                        evict_config.max_bytes)
+        if len(indices) == 0:
+            return 0
+        evicted_bytes = int(self._memory.exp_nbytes(indices).sum())
+        self._remove(indices)
+        return evicted_bytes
+
+    def _eviction_order(self, policy):
+        """
+        Returns:
+            indices of all experiences, first to be evicted first
+        """
+        if policy == 'oldest':
+            return self._memory.age_order()
+        raise ConfigError('Unsupported eviction policy for {}: {}'.format(
+            type(self).__name__, policy))
+
+    def _over_budget(self, order, max_bytes):
+        """
+        Returns:
+            the shortest prefix of order to evict to fit in max_bytes
+        """
+        if max_bytes is None:
+            return order[:0]
+        cum_nbytes = np.cumsum(self._memory.exp_nbytes(order))
+        if len(cum_nbytes) == 0 or cum_nbytes[-1] <= max_bytes:
+            return order[:0]
+        excess = cum_nbytes[-1] - max_bytes
+        return order[:np.searchsorted(cum_nbytes, excess) + 1]
+
+    def _stale_indices(self, max_staleness):
+        indices = np.arange(len(self))
+        versions = self._memory.versions(indices)
+        if max_staleness is None or len(versions) == 0:
+            return indices[:0]
+        return indices[versions < versions.max() - max_staleness]
+
+    def _remove(self, indices):
+        """
+        Returns:
+            keep, see RingStorage.remove
+        """
+        return self._memory.remove(indices)
 
     def start_sample_condition(self):
         return len(self) > self.learner_config.replay.sampling_start_size
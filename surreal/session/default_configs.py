@@ -19,10 +19,99 @@ BASE_LEARNER_CONFIG = {
         # The replay class to instantiate
         'batch_size': '_int_',
         'replay_shards': 1,
+        # If True, every learner batch is split across all shards
+        # in proportion to their size (total priority for PrioritizedReplay)
+        # instead of being sampled by whichever shard is free
+        'weighted_sampling': False,
+        # 'list': store experiences as received
+        # 'columnar': preallocated numpy arrays built from env_config.obs_spec
+        # 'compressed': columnar, with pixel observations compressed
+        # 'frame_stack': columnar, with each distinct pixel frame stored once
+        #     instead of once per stack (env_config.frame_stacks > 1)
+        'storage': 'list',
+        # If not None, bounds the memory of each shard in bytes. Columnar storage
+        # preallocates as many experiences as fit (instead of memory_size),
+        # list storage evicts the oldest experiences beyond it
+        'memory_bytes': None,
+        # Only used by 'compressed' storage
+        'compression': {
+            'codec': 'zlib',  # 'zlib' or 'lz4' (requires the lz4 package)
+            'level': 1,
+            'decompress_threads': 4,
+        },
+        # Only used by 'frame_stack' storage: frames held per experience,
+        # consecutive experiences of an episode share all frames but one,
+        # the oldest experiences are evicted when the frames run out
+        'frames_per_exp': 2,
+        # If not None, replay shards aggregate the sampled experiences
+        # and send the learner numpy arrays
+        # 'ssar': SSARAggregator, 'multistep_with_info': MultistepAggregatorWithInfo
+        'aggregator': None,
+        # Used by UniformReplay, PrioritizedReplay samples by priority
+        # but still follows the 'reservoir' insertion
+        # max_staleness is also used by FIFOReplay and TrajectoryReplay
+        'sampler': {
+            # 'uniform': all stored experiences are equally likely
+            # 'recency': the probability halves every half_life experiences
+            #     inserted since, favors fresh experiences
+            # 'reservoir': uniform, and once full the memory keeps a uniform
+            #     sample of all experiences received instead of the newest ones
+            'type': 'uniform',
+            'half_life': 100000,  # in experiences, 'recency' only
+            # If not None, only experiences whose param_version (learner
+            # iteration of the agent's parameters) is at most this far behind
+            # the newest one are sampled. FIFOReplay and TrajectoryReplay
+            # drop the others, PrioritizedReplay does not support it
+            'max_staleness': None,
+        },
+        # Only used by PrioritizedReplay
+        'prioritized': {
+            'alpha': 0.6,  # how much prioritization is used, 0 is uniform
+            'beta': 0.4,  # importance sampling correction, 1 is full
+            'eps': 1e-6,  # added to |td error| to get the new priority
+        },
+        # Run every session_config.replay.evict_interval seconds
+        'evict': {
+            # 'oldest': evict the oldest experiences until max_bytes is met
+            # 'lowest_priority': same but lowest priority first, PrioritizedReplay only
+            # 'stale': evict experiences whose param_version is behind
+            #     the newest one by more than max_staleness
+            'policy': 'oldest',
+            'max_bytes': None,
+            'max_staleness': None,
+        },
+        # Only used by TrajectoryReplay and the ExpSenderWrapperTrajectory senders
+        'trajectory': {
+            # set by the launchers' --trajectory-replay, agents then use
+            # the ExpSenderWrapperTrajectory senders
+            'enabled': False,
+            # agents send each step once, in segments of this many steps
+            'segment_length': 100,
+            # 'multistep': windows as ExpSenderWrapperMultiStepMovingWindowWithInfo sends them
+            # 'ssar': windows as ExpSenderWrapperSSARNStepBootstrap sends them
+            'window_format': 'multistep',
+            # 'fifo': each window is sampled once, in arrival order (on-policy)
+            # 'uniform': windows are sampled uniformly with replacement
+            'sampling': 'fifo',
+        },
     },
     'parameter_publish': {
         # Minimum amount of time (seconds) between two parameter publish
         'min_publish_interval': 0.3, 
+        # Precision of the parameters sent to agents: None (float32), 'fp16',
+        # 'bf16' or 'int8' (one scale per tensor). Agents load them back as
+        # float32, learner checkpoints stay full precision
+        'wire_dtype': None,
+        # Publish differences with the parameters agents hold instead of
+        # full parameters, parameter servers send agents the deltas they miss
+        'delta': {
+            'enabled': False,
+            # every full_interval publishes, full parameters are sent
+            'full_interval': 20,
+            # wire dtype of the deltas, as wire_dtype. Quantization errors
+            # are carried over to the next delta
+            'quantize': 'int8',
+        },
     },
 }
 
@@ -68,6 +157,12 @@ BASE_SESSION_CONFIG = {
         'sampler_backend_port': '_int_',
         'max_puller_queue': '_int_',  # replay side: pull queue size
         'evict_interval': '_float_',  # in seconds
+        'sample_ready_timeout': '_float_',  # in seconds, None to wait forever
+        'sampler_workers': '_int_',  # threads serving learner requests per shard
+        'sample_ahead': '_int_',  # batches kept pre-sampled and serialized, 0 to disable
+        # size of the /dev/shm ring each shard writes replies into, 0 to disable
+        # only when the learner runs on the same host as the replay shards
+        'shm_ring_bytes': '_int_',
         'tensorboard_display': True,  # display replay stats on Tensorboard
     },
     'sender': {
@@ -115,6 +210,8 @@ BASE_SESSION_CONFIG = {
     'agent': {
         'fetch_parameter_mode': '_str_',
         'fetch_parameter_interval': int,
+        'parameter_notify': False,
+        'parameter_notify_poll_interval': 30,
     },
     'learner': {
         'num_gpus': '_int_',
@@ -143,6 +240,9 @@ BASE_SESSION_CONFIG = {
             'keep_best': '_int_',
             'periodic': '_int_',
         },
+        'replay': {
+            'snapshot_interval': '_int_',  # in seconds, 0 to disable
+        },
     }
 }
 
@@ -161,6 +261,13 @@ LOCAL_SESSION_CONFIG = {
         'sampler_backend_port': 7004,
         'max_puller_queue': 10000,  # replay side: pull queue size
         'evict_interval': 0.,  # in seconds
+        # a sample request waits at most this long for the replay to be ready,
+        # then gets an empty reply
+        'sample_ready_timeout': 1.,  # in seconds, None to wait forever
+        'sampler_workers': 2,  # threads serving learner requests per shard
+        'sample_ahead': 0,  # batches kept pre-sampled and serialized, 0 to disable,
+        # not supported with learner_config.replay.weighted_sampling
+        'shm_ring_bytes': 0,  # shared memory ring for a learner on the same host
         'tensorboard_display': True,  # display replay stats on Tensorboard
     },
     'sender': {
@@ -201,6 +308,12 @@ LOCAL_SESSION_CONFIG = {
         # every episode, every n episodes, every step, every n steps
         'fetch_parameter_mode': 'episode',
         'fetch_parameter_interval': 1,
+        # subscribe to parameter server version notifications and only
+        # request parameters when a new version has been announced
+        'parameter_notify': False,
+        # with parameter_notify, request anyway after this many seconds
+        # without a request, in case notifications were lost
+        'parameter_notify_poll_interval': 30,
     },
     'learner': {
         'num_gpus': 0,
@@ -228,6 +341,13 @@ LOCAL_SESSION_CONFIG = {
             'keep_best': 0, # TODO don't keep best unless we solve the learner score issue
             'periodic': 100,
         },
+        'replay': {
+            # Each replay shard writes its memory to
+            # <folder>/checkpoint/replay-<index> and memory maps it back
+            # when restoring. Requires learner_config.replay.storage='columnar',
+            # 'compressed' or 'frame_stack'
+            'snapshot_interval': 0, # in seconds, 0 to disable
+        },
     }
 }
 
@@ -94,6 +94,12 @@ class SubprocSurrealParser:
                  'available through CUDA_VISIBLE_DEVICES, or use a '
                  'comma seperated list to override'
         )
+        parser.add_argument(
+            '--ps-relay',
+            action='store_true',
+            help='agents fetch parameters from a ps_relay process '
+                 'that subscribes to ps'
+        )
         parser.add_argument(
             '-dr', '--dry-run',
             action='store_true',
@@ -144,6 +150,12 @@ class SubprocSurrealParser:
             'ps',
             cmd=cmd_gen.get_command('ps'))
 
+        ps_relay = None
+        if args.ps_relay:
+            ps_relay = exp.new_process(
+                'ps_relay',
+                cmd=cmd_gen.get_command('ps_relay'))
+
         tensorboard = exp.new_process(
             'tensorboard',
             cmd=cmd_gen.get_command('tensorboard'))
@@ -179,7 +191,8 @@ class SubprocSurrealParser:
                       ps=ps,
                       tensorboard=tensorboard,
                       tensorplex=tensorplex,
-                      loggerplex=loggerplex)
+                      loggerplex=loggerplex,
+                      ps_relay=ps_relay)
         self._setup_gpu(agents=agents,
                         evals=evals,
                         learner=learner,
@@ -90,6 +90,12 @@ class TurrealParser(SymphonyParser):
             'available through CUDA_VISIBLE_DEVICES, or use a '
             'comma seperated list to override'
         )
+        parser.add_argument(
+            '--ps-relay',
+            action='store_true',
+            help='agents fetch parameters from a ps_relay process '
+            'that subscribes to ps'
+        )
         self._add_dry_run(parser)
 
     # ==================== helpers ====================
@@ -151,6 +157,12 @@ class TurrealParser(SymphonyParser):
             'ps',
             cmds=[cmd_gen.get_command('ps')])
 
+        ps_relay = None
+        if args.ps_relay:
+            ps_relay = exp.new_process(
+                'ps_relay',
+                cmds=[cmd_gen.get_command('ps_relay')])
+
         tensorboard = exp.new_process(
             'tensorboard',
             cmds=[cmd_gen.get_command('tensorboard')])
@@ -186,7 +198,8 @@ class TurrealParser(SymphonyParser):
                       ps=ps,
                       tensorboard=tensorboard,
                       tensorplex=tensorplex,
-                      loggerplex=loggerplex)
+                      loggerplex=loggerplex,
+                      ps_relay=ps_relay)
         self._setup_gpu(agents=agents,
                         evals=evals,
                         learner=learner,
@@ -0,0 +1,50 @@
+import numpy as np
+from surreal.replay.storage import ListStorage, FrameStackStorage
+
+
+def _exp(i):
+    return {'obs': [np.full(2, i), np.full(2, i + 1)],
+            'action': np.zeros(1),
+            'reward': float(i),
+            'done': False}
+
+
+def test_list_storage_oversize_batch_on_partial_list():
+    storage = ListStorage(5)
+    storage.insert_batch([_exp(i) for i in range(2)])
+    indices = storage.insert_batch([_exp(i) for i in range(2, 9)])
+    # the two oldest experiences of the batch are dropped
+    assert len(indices) == 5
+    assert len(storage) == 5
+    rewards = [exp['reward'] for exp in storage.get(storage.age_order())]
+    assert rewards == [4., 5., 6., 7., 8.]
+    for idx, i in zip(indices, range(4, 9)):
+        assert storage.get([idx])[0]['reward'] == float(i)
+
+
+def test_frame_stack_storage_evicts_when_frames_run_out():
+    frame_stacks = 2
+    storage = FrameStackStorage(
+        8, {'pixel': {'camera0': (frame_stacks * 3, 4, 4)}},
+        {'type': 'continuous', 'dim': [1]},
+        frame_stacks=frame_stacks, frames_per_exp=2)
+    rng = np.random.RandomState(0)
+    for step in range(10):
+        # no frame is shared, every experience needs 4 new frames
+        exp_list = [{'obs': [{'pixel': {'camera0': rng.randint(
+                                 256, size=(frame_stacks * 3, 4, 4))}}
+                             for _ in range(2)],
+                     'action': np.zeros(1),
+                     'reward': float(step),
+                     'done': False}
+                    for _ in range(2)]
+        n = storage.evictions_needed(exp_list)
+        storage.remove(storage.age_order()[:n])
+        indices = storage.insert_batch(exp_list)
+        batch = storage.get(indices)
+        for i, exp in enumerate(exp_list):
+            assert np.array_equal(batch['obs']['pixel']['camera0'][i],
+                                  exp['obs'][0]['pixel']['camera0'])
+            assert np.array_equal(batch['obs_next']['pixel']['camera0'][i],
+                                  exp['obs'][1]['pixel']['camera0'])
+    assert len(storage) == 4